@@ -1,3 +1,11 @@
 from .sbtc import *
 from .config import *
 from .srpc import *
+from .headers import *
+from .blockstats import *
+from .feeestimator import *
+from .payout import *
+from .walletsync import *
+from .session import *
+from .mempoolgraph import *
+from .rpclog import *
@@ -0,0 +1,310 @@
+#
+# Copyright (c) 2016, gijensen
+#
+from __future__ import print_function
+import os, sys, struct, array, bisect, binascii, threading
+from . import config
+from . import headers
+from . import session
+from .srpc import rpcbatch, displayResult
+
+## numpy is optional, everything falls back to the array module.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+## For Python 2.x compatibility.
+try: range = xrange
+except NameError: pass
+
+## Number of blocks requested per getblockstats batch.
+SCAN_BATCH = 200
+RETARGET_INTERVAL = 2016
+TARGET_SPACING = 600
+STATS = ['txs', 'total_size', 'total_weight', 'totalfee', 'avgfeerate', 'feerate_percentiles']
+## Columns given as rolling medians by ChainStats.series().
+SERIES = ['txs', 'size', 'feerate_p10', 'feerate_p50', 'feerate_p90']
+
+## One record per height: hash key, txs, total_size, total_weight,
+## totalfee (satoshis), avgfeerate and feerate percentiles (sat/vB).
+## The hash key is the last 8 bytes of the hash as displayed, the first ones
+## are the proof of work zeros and the same for every block.
+## A record with txs == 0 hasn't been scanned, every block has a coinbase.
+RECORD = struct.Struct('<8sIIIqI5I')
+COLUMNS = ['txs', 'size', 'weight', 'totalfee', 'avgfeerate',
+           'feerate_p10', 'feerate_p25', 'feerate_p50', 'feerate_p75', 'feerate_p90']
+## array typecodes for the fallback, totalfee is a double so it stays 64 bit
+## everywhere.
+TYPECODES = ['L', 'L', 'L', 'd', 'L', 'L', 'L', 'L', 'L', 'L']
+
+if numpy is not None:
+    RECORD_DTYPE = numpy.dtype([('hash', 'S8')] +
+                               [(name, '<i8' if name == 'totalfee' else '<u4')
+                                for name in COLUMNS])
+
+def _array(typecode, values):
+    if numpy is not None:
+        return numpy.array(values, dtype='float64' if typecode == 'd' else 'int64')
+    return array.array(typecode, values)
+
+## Sliding windows over values as a 2D view, numpy only.
+def _windows(values, window):
+    values = numpy.ascontiguousarray(values)
+    n = len(values) - window + 1
+    if n <= 0:
+        return numpy.empty((0, window), dtype=values.dtype)
+    return numpy.lib.stride_tricks.as_strided(values, (n, window), (values.strides[0],)*2, writeable=False)
+
+def rollingmedian(values, window):
+    window = int(window)
+    if numpy is not None:
+        return numpy.median(_windows(values, window), axis=1)
+
+    out = array.array('d')
+    if len(values) < window:
+        return out
+    current = sorted(values[:window])
+    mid = window // 2
+    for i in range(window, len(values)+1):
+        if window % 2:
+            out.append(float(current[mid]))
+        else:
+            out.append((current[mid-1] + current[mid]) / 2.0)
+        if i == len(values):
+            break
+        del current[bisect.bisect_left(current, values[i-window])]
+        bisect.insort(current, values[i])
+    return out
+
+## Linear interpolation between closest ranks, same as numpy.percentile.
+def percentiles(values, qs):
+    if numpy is not None:
+        if len(values) == 0:
+            return [None for i in qs]
+        return [float(i) for i in numpy.percentile(values, qs)]
+
+    data = sorted(values)
+    out = []
+    for q in qs:
+        if len(data) == 0:
+            out.append(None)
+            continue
+        pos = (len(data) - 1) * q / 100.0
+        low = int(pos)
+        high = min(low + 1, len(data) - 1)
+        out.append(data[low] + (data[high] - data[low]) * (pos - low))
+    return out
+
+## Hashes per second for every height in times/difficulties (which must be
+## for consecutive heights), estimated over the previous window blocks like
+## getnetworkhashps. The first window entries have no estimate.
+def hashps(times, difficulties, window=120):
+    window = int(window)
+    if numpy is not None:
+        times = numpy.asarray(times, dtype='float64')
+        work = numpy.asarray(difficulties, dtype='float64') * 2.0**32
+        if len(times) <= window:
+            return numpy.empty(0)
+        cumwork = numpy.cumsum(work)
+        spans = _windows(times, window + 1)
+        elapsed = spans.max(axis=1) - spans.min(axis=1)
+        elapsed[elapsed == 0] = numpy.nan
+        return (cumwork[window:] - cumwork[:-window]) / elapsed
+
+    out = array.array('d')
+    for i in range(window, len(times)):
+        span = times[i-window:i+1]
+        elapsed = max(span) - min(span)
+        work = sum(difficulties[i-window+1:i+1]) * 2.0**32
+        out.append(work / elapsed if elapsed else float('nan'))
+    return out
+
+class ChainStats(object):
+    def __init__(self, store=None, datadir=None):
+        if datadir is None:
+            datadir = config.DATADIR
+        self.store = store or headers.getstore()
+        self.path = datadir + '/sbtc.blockstats'
+        self.lock = threading.Lock()
+        if not os.path.exists(self.path):
+            open(self.path, 'wb').close()
+
+    def _read(self, start, end):
+        with open(self.path, 'rb') as f:
+            f.seek(start * RECORD.size)
+            return f.read((end - start + 1) * RECORD.size)
+
+    def _write(self, height, records):
+        with open(self.path, 'r+b') as f:
+            f.seek(0, 2)
+            size = f.tell()
+            if size < height * RECORD.size:
+                f.write(b'\0' * (height * RECORD.size - size))
+            f.seek(height * RECORD.size)
+            f.write(b''.join(records))
+
+    ## Heights in [start, end] that aren't cached or belong to a stale chain.
+    def _missing(self, start, end, data):
+        hashes = self.store.rawhashes(start, end)
+        missing = []
+        for height in range(start, end+1):
+            offset = (height - start) * RECORD.size
+            hashend = (height - start + 1) * headers.HASH_SIZE
+            txs = data[offset+8:offset+12]
+            if len(txs) < 4 or txs == b'\0\0\0\0' or \
+                    data[offset:offset+8] != hashes[hashend-8:hashend]:
+                missing.append(height)
+        return missing
+
+    def _fetch(self, heights, display=False):
+        done = 0
+        for i in range(0, len(heights), SCAN_BATCH):
+            session.checkcancelled()
+            batch = heights[i:i+SCAN_BATCH]
+            hashes = [self.store.getblockhash(h) for h in batch]
+            results = rpcbatch([('getblockstats', [h, STATS]) for h in hashes])
+
+            # Write contiguous runs, heights come in ascending order.
+            run, runstart = [], None
+            for height, blkhash, stats in zip(batch, hashes, results):
+                if runstart is not None and height != runstart + len(run):
+                    self._write(runstart, run)
+                    run, runstart = [], None
+                if runstart is None:
+                    runstart = height
+                run.append(RECORD.pack(binascii.unhexlify(blkhash)[-8:],
+                    stats['txs'], stats['total_size'], stats['total_weight'],
+                    int(stats['totalfee']), int(stats['avgfeerate']),
+                    *[int(p) for p in stats['feerate_percentiles']]))
+            if run:
+                self._write(runstart, run)
+
+            done += len(batch)
+            if display:
+                sys.stdout.write('\rScanned blocks: %d/%d' % (done, len(heights)))
+                sys.stdout.flush()
+        if display and heights:
+            print()
+
+    ## Make sure every block in [start, end] is cached and return its columns.
+    def scan(self, start, end, display=False):
+        start, end = max(0, int(start)), int(end)
+        # Also catches reorgs below our tip, which would leave stale hashes
+        # for _fetch to request.
+        self.store.update(display)
+        end = min(end, self.store.height())
+        if end < start:
+            raise ValueError('Empty height range %d-%d' % (start, end))
+
+        with self.lock:
+            missing = self._missing(start, end, self._read(start, end))
+            if missing:
+                self._fetch(missing, display)
+            data = self._read(start, end)
+
+        result = {
+            'height': _array('l', range(start, end+1)),
+            'time': _array('l', self.store.timestamps(start, end)),
+            'difficulty': _array('d', self.store.difficulties(start, end))
+        }
+        if numpy is not None:
+            records = numpy.frombuffer(data, dtype=RECORD_DTYPE)
+            for name in COLUMNS:
+                result[name] = records[name].astype('int64')
+        else:
+            rows = [RECORD.unpack_from(data, i) for i in range(0, len(data), RECORD.size)]
+            for col, (name, code) in enumerate(zip(COLUMNS, TYPECODES), 1):
+                result[name] = array.array(code, [row[col] for row in rows])
+        return result
+
+    ## Hashrate for every height in [start, end] over the previous window blocks.
+    def networkhashps(self, start, end, window=120):
+        start, end = int(start), int(end)
+        first = max(0, start - int(window))
+        times = self.store.timestamps(first, end)
+        difficulties = self.store.difficulties(first, end)
+        return hashps(times, difficulties, min(int(window), start - first) or 1)
+
+    ## Estimate the next difficulty adjustment from the epoch containing height.
+    def retarget(self, height=None):
+        if height is None:
+            height = self.store.height()
+        epochstart = height - height % RETARGET_INTERVAL
+        blocks = height - epochstart
+        difficulty = self.store.difficulties(height, height)[0]
+        result = {
+            'height': height,
+            'epoch': height // RETARGET_INTERVAL,
+            'blocks': blocks,
+            'remaining': RETARGET_INTERVAL - blocks,
+            'difficulty': difficulty
+        }
+        if blocks == 0:
+            return result
+
+        times = self.store.timestamps(epochstart, height)
+        spacing = float(times[-1] - times[0]) / blocks
+        ratio = TARGET_SPACING / spacing if spacing > 0 else 4.0
+        ratio = min(max(ratio, 0.25), 4.0)
+        result['spacing'] = spacing
+        result['change'] = ratio - 1.0
+        result['projected'] = difficulty * ratio
+        result['retargettime'] = int(times[-1] + spacing * (RETARGET_INTERVAL - blocks))
+        return result
+
+    ## Rolling medians of the SERIES columns over window blocks, for every
+    ## height in [start, end] with a full window behind it inside the range.
+    def series(self, start, end, window, display=False):
+        window = int(window)
+        data = self.scan(start, end, display)
+        if window < 1 or window > len(data['height']):
+            raise ValueError('Window must be between 1 and %d blocks' % len(data['height']))
+        result = {'height': data['height'][window-1:]}
+        for name in SERIES:
+            result[name] = rollingmedian(data[name], window)
+        return result
+
+    def summary(self, start, end, display=False):
+        data = self.scan(start, end, display)
+        start, end = int(data['height'][0]), int(data['height'][-1])
+        size = percentiles(data['size'], (50, 90))
+        feerate = percentiles(data['feerate_p50'], (50, 90))
+        window = max(1, min(end - start, end))
+        rates = self.networkhashps(end, end, window)
+        return {
+            'start': start,
+            'end': end,
+            'blocks': end - start + 1,
+            'txs': int(sum(data['txs'])),
+            'totalfee': int(sum(data['totalfee'])) / 1e8,
+            'size_median': size[0],
+            'size_p90': size[1],
+            'feerate_median': feerate[0],
+            'feerate_p90': feerate[1],
+            'networkhashps': float(rates[-1]) if len(rates) else None,
+            'retarget': self.retarget(end)
+        }
+
+_engine = None
+
+def getchainstats():
+    global _engine
+    if _engine is None:
+        _engine = ChainStats()
+    return _engine
+
+## Summary of [start, end], or with a window the rolling median series.
+def chainstats(start, end, window=None, display=False):
+    if window is None:
+        result = getchainstats().summary(int(start), int(end), display)
+        if display: displayResult(result)
+        return result
+
+    result = getchainstats().series(int(start), int(end), window, display)
+    if display:
+        print(' '.join(['%10s' % i for i in ['height'] + SERIES]))
+        for n in range(len(result['height'])):
+            print(' '.join(['%10d' % result['height'][n]] +
+                           ['%10.1f' % result[name][n] for name in SERIES]))
+    return result
@@ -15,6 +15,32 @@ RPCPORT = 8332
 ## If True will ignore the UID of bitcoind. ABSOLUTELY NOT RECOMMENDED.
 IGNORE_BITCOIND_UID = False
 
+## Share one outstanding request between identical concurrent read-only calls.
+RPC_SINGLEFLIGHT = True
+## Seconds to memoize tip-dependent queries (getdifficulty etc.), 0 disables.
+## The memo is dropped as soon as a new tip is observed.
+RPC_TIPMEMO_TTL = 0
+
+## Seconds between tip checks while the header cache follows bitcoind.
+HEADER_POLL_INTERVAL = 1.0
+## Seconds between mempool polls while the local fee estimator follows bitcoind.
+FEEEST_POLL_INTERVAL = 10.0
+
+## Show the tip height in the console prompt.
+PROMPT_TIP = True
+## Seconds between getbestblockhash polls for the prompt when the header cache
+## is disabled. With it enabled the height is read from the cache instead.
+PROMPT_POLL_INTERVAL = 60.0
+## Commands kept in <datadir>/sbtc.history.
+HISTORY_SIZE = 1000
+
+## Payout transactions per JSON-RPC batch and the limits for each of them.
+PAYOUT_BATCH = 20
+PAYOUT_MAX_OUTPUTS = 250
+PAYOUT_MAX_VSIZE = 90000
+## Fee rate in sat/vB used to reserve inputs, fundrawtransaction sets the real fee.
+PAYOUT_FEERATE = 50
+
 ALIASES = {
         'getbcinfo':'getblockchaininfo',
         'getrawtx':'getrawtransaction',
@@ -0,0 +1,237 @@
+#
+# Copyright (c) 2016, gijensen
+#
+from __future__ import print_function
+import os, json, threading
+from . import config
+from .srpc import rpccommand, rpcbatch, displayResult
+
+## For Python 2.x compatibility.
+try: range = xrange
+except NameError: pass
+
+## Longest confirmation target tracked, in blocks.
+MAXTARGET = 48
+## Per-block decay applied to every counter so old blocks fade out.
+DECAY = 0.995
+## Minimum (decayed) number of transactions a bucket group needs before
+## its success rate is trusted.
+MINDATA = 2.0
+STATE_VERSION = 1
+
+## Fee rate bucket lower bounds in sat/vB, 10% apart.
+def _buckets(low=1.0, high=10000.0, step=1.1):
+    out = []
+    rate = low
+    while rate < high:
+        out.append(rate)
+        rate *= step
+    return out
+
+BUCKETS = _buckets()
+
+def _bucket(feerate):
+    low, high = 0, len(BUCKETS) - 1
+    if feerate < BUCKETS[0]:
+        return 0
+    while low < high:
+        mid = (low + high + 1) // 2
+        if BUCKETS[mid] <= feerate:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+## Fee rate in sat/vB from a getrawmempool verbose entry.
+def _feerate(entry):
+    if 'fees' in entry:
+        fee = entry['fees']['base']
+    else:
+        fee = entry['fee']
+    size = entry.get('vsize', entry.get('size'))
+    return fee * 1e8 / size
+
+## Fee rate histogram built from the mempool and newly confirmed blocks.
+##
+## confirmed[b][t] counts transactions from bucket b that confirmed t+1
+## blocks after entering the mempool, failed[b] those that waited longer
+## than MAXTARGET. Both decay by DECAY every block. Answers are cached
+## until the next update() so repeated estimate() calls are dict lookups.
+class FeeEstimator(object):
+    def __init__(self, datadir=None):
+        if datadir is None:
+            datadir = config.DATADIR
+        self.path = datadir + '/sbtc.feeest'
+        self.lock = threading.RLock()
+        self.height = -1
+        self.blkhash = None
+        self.confirmed = [[0.0]*MAXTARGET for i in BUCKETS]
+        self.failed = [0.0]*len(BUCKETS)
+        ## txid -> [height it entered the mempool, bucket]
+        self.tracked = {}
+        self._cache = {}
+        self._follower = None
+        self._stop = threading.Event()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                state = json.load(f)
+        except (IOError, OSError, ValueError):
+            return False
+        if state.get('version') != STATE_VERSION or len(state['failed']) != len(BUCKETS):
+            return False
+        with self.lock:
+            self.height = state['height']
+            self.blkhash = state['hash']
+            self.confirmed = state['confirmed']
+            self.failed = state['failed']
+            self.tracked = state['tracked']
+            self._cache = {}
+        return True
+
+    def save(self):
+        with self.lock:
+            state = {
+                'version': STATE_VERSION,
+                'height': self.height,
+                'hash': self.blkhash,
+                'confirmed': self.confirmed,
+                'failed': self.failed,
+                'tracked': self.tracked
+            }
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(state, f)
+            os.rename(tmp, self.path)
+
+    ## Must be called with self.lock held.
+    def _processblock(self, height, txids):
+        for b in range(len(BUCKETS)):
+            row = self.confirmed[b]
+            for t in range(MAXTARGET):
+                row[t] *= DECAY
+            self.failed[b] *= DECAY
+
+        for txid in txids:
+            entry = self.tracked.pop(txid, None)
+            if entry is None:
+                continue
+            blocks = height - entry[0]
+            if 1 <= blocks <= MAXTARGET:
+                self.confirmed[entry[1]][blocks-1] += 1
+
+        for txid in [k for k, v in self.tracked.items() if height - v[0] >= MAXTARGET]:
+            self.failed[self.tracked.pop(txid)[1]] += 1
+
+    ## Pull new blocks and mempool entries from bitcoind.
+    def update(self, display=False):
+        tip = rpccommand('getblockcount')
+        tiphash = rpccommand('getblockhash', [tip])
+        with self.lock:
+            height = self.height
+            blkhash = self.blkhash
+
+        blocks = 0
+        if height >= 0 and tip > height:
+            if rpccommand('getblockhash', [height]) != blkhash:
+                # Reorged since the last update, forget the unknown blocks.
+                height = tip
+            start = max(height + 1, tip - MAXTARGET + 1)
+            hashes = rpcbatch([('getblockhash', [i]) for i in range(start, tip+1)])
+            txids = rpcbatch([('getblock', [i, True]) for i in hashes])
+            with self.lock:
+                for i, block in enumerate(txids, start):
+                    self._processblock(i, block['tx'])
+                    blocks += 1
+
+        mempool = rpccommand('getrawmempool', [True])
+        with self.lock:
+            for txid in list(self.tracked.keys()):
+                if txid not in mempool:
+                    del self.tracked[txid]
+            for txid, entry in mempool.items():
+                if txid not in self.tracked:
+                    self.tracked[txid] = [entry.get('height', tip), _bucket(_feerate(entry))]
+            self.height = tip
+            self.blkhash = tiphash
+            self._cache = {}
+
+        if blocks or height < 0:
+            self.save()
+        if display:
+            print('Fee estimator at height %d, %d blocks processed, %d txs tracked.' % (tip, blocks, len(self.tracked)))
+        return blocks
+
+    ## Lowest fee rate (BTC/kB, like estimatefee) at which at least confidence
+    ## of transactions confirmed within target blocks, -1 without enough data.
+    def estimate(self, target, confidence=0.85):
+        key = (target, confidence)
+        result = self._cache.get(key)
+        if result is not None:
+            return result
+
+        target = min(max(int(target), 1), MAXTARGET)
+        with self.lock:
+            waiting = [0]*len(BUCKETS)
+            for entry in self.tracked.values():
+                if self.height - entry[0] >= target:
+                    waiting[entry[1]] += 1
+
+            passing = None
+            good = total = 0.0
+            for b in range(len(BUCKETS)-1, -1, -1):
+                row = self.confirmed[b]
+                good += sum(row[:target])
+                total += sum(row) + self.failed[b] + waiting[b]
+                if total < MINDATA:
+                    continue
+                if good / total < confidence:
+                    break
+                passing = b
+                good = total = 0.0
+
+            result = -1 if passing is None else round(BUCKETS[passing] * 1e-5, 8)
+            self._cache[key] = result
+        return result
+
+    def _follow(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.update()
+            except Exception:
+                pass
+
+    ## Keep the estimator current from a background thread.
+    def follow(self, interval=None):
+        if interval is None:
+            interval = config.FEEEST_POLL_INTERVAL
+        if self._follower is not None:
+            return
+        self._stop.clear()
+        self._follower = threading.Thread(target=self._follow, args=(interval,))
+        self._follower.daemon = True
+        self._follower.start()
+
+    def unfollow(self):
+        if self._follower is not None:
+            self._stop.set()
+            self._follower.join()
+            self._follower = None
+
+_estimator = None
+
+def getfeeestimator():
+    global _estimator
+    if _estimator is None:
+        _estimator = FeeEstimator()
+    return _estimator
+
+def feeupdate(display=False):
+    return getfeeestimator().update(display)
+
+def localfee(target, confidence=0.85, display=False):
+    result = getfeeestimator().estimate(int(target), float(confidence))
+    if display: displayResult(result)
+    return result
@@ -0,0 +1,335 @@
+#
+# Copyright (c) 2016, gijensen
+#
+from __future__ import print_function
+import os, sys, mmap, struct, binascii, threading, time
+from . import config
+from . import srpc
+from . import session
+from .srpc import rpccommand, rpcbatch
+
+## For Python 2.x compatibility.
+try: range = xrange
+except NameError: pass
+
+HEADER_SIZE = 80
+HASH_SIZE = 32
+## Number of heights requested per batch while syncing.
+SYNC_BATCH = 2000
+
+def _hex(data):
+    return binascii.hexlify(data).decode('ascii')
+
+## Same calculation as bitcoind's GetDifficulty().
+def bitsToDifficulty(bits):
+    shift = (bits >> 24) & 0xff
+    diff = float(0x0000ffff) / float(bits & 0x00ffffff)
+    while shift < 29:
+        diff *= 256.0
+        shift += 1
+    while shift > 29:
+        diff /= 256.0
+        shift -= 1
+    return diff
+
+## Local copy of the header chain.
+##
+## Headers are kept in <datadir>/sbtc.headers as raw 80 byte records and the
+## height->hash index in <datadir>/sbtc.hashes as 32 byte records, both
+## indexed by height and memory-mapped for reading.
+class HeaderStore(object):
+    def __init__(self, datadir=None):
+        if datadir is None:
+            datadir = config.DATADIR
+        self.headerpath = datadir + '/sbtc.headers'
+        self.hashpath = datadir + '/sbtc.hashes'
+        self.lock = threading.RLock()
+        self.count = 0
+        self._headers = None
+        self._hashes = None
+        self._index = None
+        self._follower = None
+        self._current = False
+        self._stop = threading.Event()
+
+        for path in (self.headerpath, self.hashpath):
+            if not os.path.exists(path):
+                open(path, 'wb').close()
+        self._headerfile = open(self.headerpath, 'r+b')
+        self._hashfile = open(self.hashpath, 'r+b')
+
+        # Drop any partially written record left by an interrupted sync.
+        count = min(os.path.getsize(self.headerpath) // HEADER_SIZE,
+                    os.path.getsize(self.hashpath) // HASH_SIZE)
+        self._truncate(count)
+
+    def close(self):
+        self.unfollow()
+        with self.lock:
+            self._headers = self._hashes = None
+            self._headerfile.close()
+            self._hashfile.close()
+
+    ## Must be called with self.lock held.
+    def _remap(self):
+        self._headerfile.flush()
+        self._hashfile.flush()
+        self.count = os.fstat(self._hashfile.fileno()).st_size // HASH_SIZE
+        if self.count == 0:
+            self._headers = self._hashes = None
+        else:
+            self._headers = mmap.mmap(self._headerfile.fileno(), 0, access=mmap.ACCESS_READ)
+            self._hashes = mmap.mmap(self._hashfile.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _truncate(self, count):
+        with self.lock:
+            self._headers = self._hashes = None
+            self._headerfile.truncate(count * HEADER_SIZE)
+            self._hashfile.truncate(count * HASH_SIZE)
+            if self._index is not None:
+                for i in [k for k, v in self._index.items() if v >= count]:
+                    del self._index[i]
+            self._remap()
+
+    ## hashes are hex strings as returned by getblockhash, raws are the
+    ## matching non-verbose getblockheader results. Returns False if the
+    ## headers don't connect to the current tip.
+    def _append(self, hashes, raws):
+        with self.lock:
+            headers = []
+            binhashes = []
+            prev = self._hashat(self.count-1) if self.count else None
+            for blkhash, raw in zip(hashes, raws):
+                header = binascii.unhexlify(raw)
+                binhash = binascii.unhexlify(blkhash)
+                if prev is not None and header[4:36][::-1] != prev:
+                    return False
+                headers.append(header)
+                binhashes.append(binhash)
+                prev = binhash
+
+            self._headerfile.seek(0, 2)
+            self._headerfile.write(b''.join(headers))
+            self._hashfile.seek(0, 2)
+            self._hashfile.write(b''.join(binhashes))
+            if self._index is not None:
+                for i, binhash in enumerate(binhashes, self.count):
+                    self._index[binhash] = i
+            self._remap()
+            return True
+
+    def _hashat(self, height):
+        return self._hashes[height*HASH_SIZE:(height+1)*HASH_SIZE]
+
+    def _headerat(self, height):
+        return self._headers[height*HEADER_SIZE:(height+1)*HEADER_SIZE]
+
+    def height(self):
+        return self.count - 1
+
+    ## Returns the height of blkhash or None if it isn't in the main chain.
+    def heightof(self, blkhash):
+        with self.lock:
+            if self._index is None:
+                self._index = {}
+                for i in range(self.count):
+                    self._index[self._hashat(i)] = i
+            try:
+                return self._index.get(binascii.unhexlify(blkhash))
+            except (TypeError, ValueError):
+                return None
+
+    ## Walk back from the tip until our chain agrees with bitcoind's.
+    def rollback(self):
+        nodeheight = rpccommand('getblockcount')
+        with self.lock:
+            if self.count - 1 > nodeheight:
+                self._truncate(nodeheight + 1)
+            height = self.count - 1
+
+        step = 1
+        while height >= 0:
+            low = max(0, height - step + 1)
+            remote = rpcbatch([('getblockhash', [i]) for i in range(low, height+1)])
+            with self.lock:
+                for i in range(height, low-1, -1):
+                    if binascii.unhexlify(remote[i-low]) == self._hashat(i):
+                        if i + 1 < self.count:
+                            self._truncate(i + 1)
+                        return i
+            height = low - 1
+            step *= 16
+
+        self._truncate(0)
+        return -1
+
+    def sync(self, display=False):
+        self.rollback()
+        tip = rpccommand('getblockcount')
+        start = self.count
+        while start <= tip:
+            session.checkcancelled()
+            end = min(start + SYNC_BATCH, tip + 1)
+            hashes = rpcbatch([('getblockhash', [i]) for i in range(start, end)])
+            raws = rpcbatch([('getblockheader', [i, False]) for i in hashes])
+            if not self._append(hashes, raws):
+                # Reorg while syncing, find the fork point and carry on.
+                self.rollback()
+                tip = rpccommand('getblockcount')
+            start = self.count
+            if display:
+                sys.stdout.write('\rSynced headers: %d/%d' % (self.count - 1, tip))
+                sys.stdout.flush()
+        if display:
+            print('\rSynced headers: %d/%d' % (self.count - 1, tip))
+        return self.count - 1
+
+    ## Cheap tip check, only syncs when bitcoind has a different tip.
+    def update(self, display=False):
+        if rpccommand('getbestblockhash') != self.getbestblockhash():
+            return self.sync(display)
+        return self.count - 1
+
+    def _follow(self, interval):
+        while True:
+            try:
+                self.update()
+                self._current = True
+            except Exception:
+                self._current = False
+            # Every update() probes getbestblockhash, which drops the RPC tip
+            # memo, as long as it keeps working.
+            srpc.settipfollowed(self._current)
+            if self._stop.wait(interval):
+                return
+
+    ## True while the follower runs and its last update succeeded, only then
+    ## are answers depending on the tip served locally.
+    def current(self):
+        return self._follower is not None and self._current
+
+    ## Keep the store at the tip from a background thread.
+    def follow(self, interval=None):
+        if interval is None:
+            interval = config.HEADER_POLL_INTERVAL
+        if self._follower is not None:
+            return
+        self._stop.clear()
+        self._follower = threading.Thread(target=self._follow, args=(interval,))
+        self._follower.daemon = True
+        self._follower.start()
+
+    def unfollow(self):
+        if self._follower is not None:
+            self._stop.set()
+            self._follower.join()
+            self._follower = None
+            self._current = False
+            srpc.settipfollowed(False)
+
+    ## RPC equivalents, return None when the answer isn't available locally.
+    def getbestblockhash(self):
+        with self.lock:
+            if self.count == 0:
+                return None
+            return _hex(self._hashat(self.count-1))
+
+    def getblockhash(self, height):
+        with self.lock:
+            if height < 0 or height >= self.count:
+                return None
+            return _hex(self._hashat(height))
+
+    ## The verbose form has everything bitcoind returns except chainwork.
+    def getblockheader(self, blkhash, verbose=True):
+        with self.lock:
+            height = self.heightof(blkhash)
+            if height is None:
+                return None
+            header = self._headerat(height)
+            if not verbose:
+                return _hex(header)
+
+            version, = struct.unpack('<i', header[0:4])
+            btime, bits, nonce = struct.unpack('<III', header[68:80])
+            result = {
+                'hash': blkhash,
+                'confirmations': self.count - height,
+                'height': height,
+                'version': version,
+                'versionHex': '%08x' % (version & 0xffffffff),
+                'merkleroot': _hex(header[36:68][::-1]),
+                'time': btime,
+                'mediantime': self.mediantime(height),
+                'nonce': nonce,
+                'bits': '%08x' % bits,
+                'difficulty': bitsToDifficulty(bits)
+            }
+            if height > 0:
+                result['previousblockhash'] = _hex(header[4:36][::-1])
+            if height + 1 < self.count:
+                result['nextblockhash'] = _hex(self._hashat(height+1))
+            return result
+
+    ## Bulk queries over an inclusive height range.
+    def rawhashes(self, start, end):
+        with self.lock:
+            end = min(end, self.count - 1)
+            return self._hashes[max(start, 0)*HASH_SIZE:(end+1)*HASH_SIZE]
+
+    def _field(self, start, end, offset):
+        with self.lock:
+            end = min(end, self.count - 1)
+            m = self._headers
+            return [struct.unpack_from('<I', m, i*HEADER_SIZE + offset)[0]
+                    for i in range(max(start, 0), end+1)]
+
+    def timestamps(self, start, end):
+        return self._field(start, end, 68)
+
+    def bits(self, start, end):
+        return self._field(start, end, 72)
+
+    def difficulties(self, start, end):
+        return [bitsToDifficulty(i) for i in self.bits(start, end)]
+
+    ## Median of the previous 11 block times, like bitcoind.
+    def mediantime(self, height):
+        times = self.timestamps(max(0, height - 10), height)
+        times.sort()
+        return times[len(times)//2]
+
+_store = None
+
+def getstore():
+    global _store
+    if _store is None:
+        _store = HeaderStore()
+    return _store
+
+def syncheaders(display=False):
+    return getstore().sync(display)
+
+## Answer getblockhash/getblockheader/getbestblockhash from the local store.
+def enableheadercache(follow=True, display=False):
+    store = getstore()
+    store.sync(display)
+    if follow:
+        store.follow()
+    srpc.setheaderstore(store)
+    if display:
+        print('Header cache enabled at height %d.' % store.height())
+    return store
+
+def disableheadercache(display=False):
+    srpc.setheaderstore(None)
+    if _store is not None:
+        _store.unfollow()
+    if display:
+        print('Header cache disabled.')
+
+def headercache(enable=True, display=False):
+    if srpc.toBool(enable):
+        return enableheadercache(display=display)
+    else:
+        return disableheadercache(display=display)
@@ -0,0 +1,210 @@
+#
+# Copyright (c) 2016, gijensen
+#
+from __future__ import print_function
+import threading
+from . import session
+from .srpc import rpccommand, rpcbatch, displayResult, RPCError
+
+## Transactions fetched per batch while syncing.
+MEMPOOL_BATCH = 500
+
+class _Entry(object):
+    __slots__ = ('fee', 'vsize', 'spends', 'nout', 'parents', 'children')
+
+    def __init__(self, fee, vsize, spends, nout):
+        self.fee = fee
+        self.vsize = vsize
+        self.spends = spends
+        self.nout = nout
+        self.parents = set()
+        self.children = set()
+
+## Fee in satoshis and vsize from a getmempoolentry result.
+def _feesize(entry):
+    if 'fees' in entry:
+        fee = entry['fees']['base']
+    else:
+        fee = entry['fee']
+    return int(round(fee * 1e8)), entry.get('vsize', entry.get('size'))
+
+## In-memory index of the mempool's transaction graph.
+##
+## Every transaction knows the outpoints it spends and spenders maps each
+## spent outpoint to its spender, which gives the parent->child edges.
+## update() only fetches transactions that are new since the last call.
+class MempoolGraph(object):
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.entries = {}
+        self.spenders = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, txid):
+        return txid in self.entries
+
+    ## Must be called with self.lock held.
+    def _add(self, txid, entry):
+        self.entries[txid] = entry
+        for outpoint in entry.spends:
+            self.spenders[outpoint] = txid
+            parent = self.entries.get(outpoint[0])
+            if parent is not None:
+                entry.parents.add(outpoint[0])
+                parent.children.add(txid)
+        # Children can be indexed before their parent if it was fetched late.
+        for n in range(entry.nout):
+            child = self.spenders.get((txid, n))
+            if child is not None and child in self.entries:
+                entry.children.add(child)
+                self.entries[child].parents.add(txid)
+
+    ## Must be called with self.lock held.
+    def _remove(self, txid):
+        entry = self.entries.pop(txid)
+        for outpoint in entry.spends:
+            if self.spenders.get(outpoint) == txid:
+                del self.spenders[outpoint]
+        for parent in entry.parents:
+            if parent in self.entries:
+                self.entries[parent].children.discard(txid)
+        for child in entry.children:
+            if child in self.entries:
+                self.entries[child].parents.discard(txid)
+
+    def update(self, display=False):
+        txids = set(rpccommand('getrawmempool', [False]))
+        with self.lock:
+            removed = [i for i in self.entries if i not in txids]
+            for txid in removed:
+                self._remove(txid)
+            new = [i for i in txids if i not in self.entries]
+
+        added = 0
+        for i in range(0, len(new), MEMPOOL_BATCH):
+            session.checkcancelled()
+            batch = new[i:i+MEMPOOL_BATCH]
+            entries = rpcbatch([('getmempoolentry', [txid]) for txid in batch], strict=False)
+            txs = rpcbatch([('getrawtransaction', [txid, 1]) for txid in batch], strict=False)
+            with self.lock:
+                for txid, entry, tx in zip(batch, entries, txs):
+                    # Gone from the mempool since getrawmempool.
+                    if isinstance(entry, RPCError) or isinstance(tx, RPCError):
+                        continue
+                    fee, vsize = _feesize(entry)
+                    spends = [(i['txid'], i['vout']) for i in tx['vin'] if 'txid' in i]
+                    self._add(txid, _Entry(fee, vsize, spends, len(tx['vout'])))
+                    added += 1
+
+        if display:
+            print('Mempool graph: %d txs, %d added, %d removed.' % (len(self.entries), added, len(removed)))
+        return added
+
+    def _walk(self, txid, attr):
+        with self.lock:
+            seen = set()
+            stack = [txid]
+            while stack:
+                for i in getattr(self.entries[stack.pop()], attr):
+                    if i not in seen:
+                        seen.add(i)
+                        stack.append(i)
+            return seen
+
+    def ancestors(self, txid):
+        return self._walk(txid, 'parents')
+
+    def descendants(self, txid):
+        return self._walk(txid, 'children')
+
+    ## Fee, vsize and fee rate (sat/vB) of txid with its ancestors (what a
+    ## miner considers for CPFP) and with its descendants (what replacing it
+    ## would evict).
+    def package(self, txid):
+        with self.lock:
+            entry = self.entries[txid]
+            result = {'txid': txid, 'fee': entry.fee, 'vsize': entry.vsize,
+                      'feerate': float(entry.fee) / entry.vsize}
+            for name, txids in (('ancestor', self.ancestors(txid)), ('descendant', self.descendants(txid))):
+                fee = entry.fee + sum(self.entries[i].fee for i in txids)
+                vsize = entry.vsize + sum(self.entries[i].vsize for i in txids)
+                result[name + 'count'] = len(txids) + 1
+                result[name + 'fee'] = fee
+                result[name + 'vsize'] = vsize
+                result[name + 'feerate'] = float(fee) / vsize
+            return result
+
+    ## Mempool txs a transaction spending outpoints would conflict with,
+    ## including their descendants, i.e. everything an RBF replacement evicts.
+    def conflicts(self, outpoints, ignore=None):
+        with self.lock:
+            direct = set()
+            for outpoint in outpoints:
+                spender = self.spenders.get(tuple(outpoint))
+                if spender is not None and spender != ignore:
+                    direct.add(spender)
+            result = set(direct)
+            for txid in direct:
+                result |= self.descendants(txid)
+            return result
+
+_graph = None
+
+def getmempoolgraph():
+    global _graph
+    if _graph is None:
+        _graph = MempoolGraph()
+    return _graph
+
+def mempoolsync(display=False):
+    return getmempoolgraph().update(display)
+
+## The graph brought up to date with the mempool, or None if txid isn't in it.
+def _known(txid):
+    graph = getmempoolgraph()
+    graph.update()
+    if txid not in graph:
+        print('Not in mempool: %s' % txid)
+        return None
+    return graph
+
+def ancestors(txid, display=False):
+    graph = _known(txid)
+    if graph is None:
+        return None
+    result = sorted(graph.ancestors(txid))
+    if display: displayResult(result)
+    return result
+
+def descendants(txid, display=False):
+    graph = _known(txid)
+    if graph is None:
+        return None
+    result = sorted(graph.descendants(txid))
+    if display: displayResult(result)
+    return result
+
+def mempoolpackage(txid, display=False):
+    graph = _known(txid)
+    if graph is None:
+        return None
+    result = graph.package(txid)
+    if display: displayResult(result)
+    return result
+
+## hexstr is a raw transaction, or the txid of one already in the mempool.
+def mempoolconflicts(hexstr, display=False):
+    graph = getmempoolgraph()
+    graph.update()
+    if hexstr in graph:
+        txid = hexstr
+        outpoints = graph.entries[txid].spends
+    else:
+        tx = rpccommand('decoderawtransaction', [hexstr])
+        txid = tx['txid']
+        outpoints = [(i['txid'], i['vout']) for i in tx['vin'] if 'txid' in i]
+    result = sorted(graph.conflicts(outpoints, txid))
+    if display: displayResult(result)
+    return result
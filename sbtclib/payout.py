@@ -0,0 +1,294 @@
+#
+# Copyright (c) 2016, gijensen
+#
+from __future__ import print_function
+import csv, itertools
+from decimal import Decimal, InvalidOperation
+from . import config
+from . import session
+from .srpc import rpccommand, rpcbatch, RPCError
+
+## Rough vsizes used to bound transactions and reserve enough inputs.
+TX_OVERHEAD = 11
+INPUT_VSIZE = 148
+OUTPUT_VSIZE = 34
+## Outputs below this many satoshis are rejected as dust by bitcoind.
+DUST_LIMIT = 546
+
+COIN = Decimal(100000000)
+
+def toSatoshis(amount):
+    return int((Decimal(str(amount)) * COIN).to_integral_value())
+
+def toBTC(satoshis):
+    return float(Decimal(satoshis) / COIN)
+
+## Yield (address, amount) rows from a CSV file, a header row is skipped.
+def readpayouts(path):
+    with open(path, 'r') as f:
+        for n, row in enumerate(csv.reader(f)):
+            if len(row) < 2 or row[0].strip().startswith('#'):
+                continue
+            try:
+                amount = Decimal(row[1].strip())
+            except InvalidOperation:
+                if n == 0:
+                    continue
+                raise ValueError('Invalid amount on line %d: %s' % (n + 1, row[1]))
+            yield row[0].strip(), amount
+
+class _Tx(object):
+    def __init__(self):
+        self.payouts = []
+        self.inputs = []
+        self.addresses = set()
+        self.total = 0
+        self.hex = None
+        self.changepos = -1
+        self.vout = []
+
+    def vsize(self, inputs=None, outputs=None):
+        if inputs is None:
+            inputs = len(self.inputs)
+        if outputs is None:
+            outputs = len(self.payouts)
+        # One extra output for change.
+        return TX_OVERHEAD + INPUT_VSIZE*inputs + OUTPUT_VSIZE*(outputs + 1)
+
+## Packs payouts into multi-output transactions funded from a single
+## listunspent snapshot, then pushes them through createrawtransaction,
+## fundrawtransaction, signrawtransaction and sendrawtransaction, one JSON-RPC
+## batch per stage for every config.PAYOUT_BATCH transactions.
+##
+## Only the inputs of the batch being sent are locked, from just before
+## fundrawtransaction until sendrawtransaction, so the wallet can't hand them
+## to another transaction of the batch. The rest of the wallet stays usable.
+## Transactions whose inputs were spent elsewhere since the snapshot are
+## packed again from the remaining coins. The change of every sent
+## transaction goes back into the pool for the following batches.
+class Payout(object):
+    def __init__(self, minconf=1, feerate=None, maxoutputs=None, maxvsize=None, lock=True):
+        self.minconf = minconf
+        self.feerate = config.PAYOUT_FEERATE if feerate is None else feerate
+        self.maxoutputs = config.PAYOUT_MAX_OUTPUTS if maxoutputs is None else maxoutputs
+        self.maxvsize = config.PAYOUT_MAX_VSIZE if maxvsize is None else maxvsize
+        self.lock = lock
+        self.coins = []
+        self.locked = []
+
+    def _snapshot(self):
+        coins = [i for i in rpccommand('listunspent', [self.minconf, 999999999])
+                 if i.get('spendable', True)]
+        # Largest first, popped from the end so keep them ascending.
+        coins.sort(key=lambda i: i['amount'])
+        self.coins = [(toSatoshis(i['amount']), {'txid': i['txid'], 'vout': i['vout']}) for i in coins]
+
+    ## Lock the inputs of every tx, returns the txs that were locked and the
+    ## ones whose inputs are gone. Their coins are dropped from the pool.
+    def _lockinputs(self, txs):
+        if not self.lock:
+            return txs, []
+        results = rpcbatch([('lockunspent', [False, [i[1] for i in tx.inputs]]) for tx in txs], strict=False)
+        out = []
+        stale = []
+        for tx, result in zip(txs, results):
+            if isinstance(result, RPCError):
+                stale.append(tx)
+            else:
+                self.locked.extend(i[1] for i in tx.inputs)
+                out.append(tx)
+        return out, stale
+
+    ## fundrawtransaction may add wallet coins of its own. Take them out of
+    ## the pool so later transactions don't spend them again. A tx that got
+    ## one already added to an earlier tx of the batch gives its coins back
+    ## and is returned to be packed again.
+    def _claimextra(self, txs, decoded):
+        claimed = set()
+        out = []
+        retry = []
+        for tx, result in zip(txs, decoded):
+            ours = set((i[1]['txid'], i[1]['vout']) for i in tx.inputs)
+            extra = set((i['txid'], i['vout']) for i in result['vin']) - ours
+            if extra & claimed:
+                self.coins.extend(tx.inputs)
+                retry.append(tx)
+                continue
+            claimed |= extra
+            out.append(tx)
+        self.coins = [i for i in self.coins if (i[1]['txid'], i[1]['vout']) not in claimed]
+        self.coins.sort(key=lambda i: i[0])
+        return out, retry
+
+    def _unlock(self, spent):
+        if not self.locked:
+            return
+        spent = set((i['txid'], i['vout']) for i in spent)
+        unlock = [i for i in self.locked if (i['txid'], i['vout']) not in spent]
+        if unlock:
+            rpccommand('lockunspent', [True, unlock])
+        self.locked = []
+
+    ## Take coins until tx can pay its outputs plus the fee at self.feerate.
+    def _fund(self, tx):
+        while True:
+            need = tx.total + int(tx.vsize() * self.feerate)
+            funded = sum(i[0] for i in tx.inputs)
+            if funded >= need:
+                return True
+            if not self.coins:
+                return False
+            tx.inputs.append(self.coins.pop())
+
+    ## Group rows into transactions, rows that can't be funded are failed.
+    ## Stops after count transactions and returns the rows it didn't use.
+    def _pack(self, rows, count):
+        txs = []
+        tx = _Tx()
+        failed = []
+        for n, (address, amount) in enumerate(rows):
+            satoshis = toSatoshis(amount)
+            if len(tx.payouts) >= self.maxoutputs or address in tx.addresses or \
+                    tx.vsize(outputs=len(tx.payouts) + 1) > self.maxvsize:
+                if tx.payouts:
+                    txs.append(tx)
+                    if len(txs) >= count:
+                        return txs, failed, rows[n:]
+                tx = _Tx()
+            tx.payouts.append((address, amount, satoshis))
+            tx.addresses.add(address)
+            tx.total += satoshis
+            before = len(tx.inputs)
+            if not self._fund(tx):
+                self.coins.extend(tx.inputs[before:])
+                self.coins.sort(key=lambda i: i[0])
+                del tx.inputs[before:]
+                tx.payouts.pop()
+                tx.addresses.discard(address)
+                tx.total -= satoshis
+                failed.append((address, amount))
+        if tx.payouts:
+            txs.append(tx)
+        return txs, failed, []
+
+    ## Split rows into valid ones and (address, amount, error) for the rest,
+    ## so a bad row can't fail a whole packed transaction.
+    def _validate(self, rows):
+        valid = []
+        invalid = []
+        for address, amount in rows:
+            if toSatoshis(amount) < DUST_LIMIT:
+                invalid.append((address, amount, 'Amount is below the dust limit'))
+            else:
+                valid.append((address, amount))
+        results = rpcbatch([('validateaddress', [i[0]]) for i in valid], strict=False)
+        rows = valid
+        valid = []
+        for (address, amount), result in zip(rows, results):
+            if isinstance(result, RPCError) or not result.get('isvalid'):
+                invalid.append((address, amount, 'Invalid address'))
+            else:
+                valid.append((address, amount))
+        return valid, invalid
+
+    ## Run one stage over txs, dropping the ones that failed into failures.
+    def _stage(self, txs, calls, failures):
+        results = rpcbatch(calls, strict=False)
+        out = []
+        for tx, result in zip(txs, results):
+            if isinstance(result, RPCError):
+                failures.append((tx, result))
+            else:
+                out.append((tx, result))
+        return out
+
+    ## Returns the sent (tx, txid) pairs, the failed (tx, error) pairs and the
+    ## txs to pack again.
+    def _send(self, txs):
+        failures = []
+        hexes = self._stage(txs, [('createrawtransaction',
+                                   [[i[1] for i in tx.inputs],
+                                    dict((i[0], toBTC(i[2])) for i in tx.payouts)])
+                                  for tx in txs], failures)
+        for tx, result in hexes:
+            tx.hex = result
+        txs, stale = self._lockinputs([i[0] for i in hexes])
+        funded = self._stage(txs, [('fundrawtransaction', [tx.hex]) for tx in txs], failures)
+        for tx, result in funded:
+            tx.hex = result['hex']
+            tx.changepos = result.get('changepos', -1)
+        txs = [i[0] for i in funded]
+        decoded = self._stage(txs, [('decoderawtransaction', [tx.hex]) for tx in txs], failures)
+        for tx, result in decoded:
+            tx.vout = result['vout']
+        txs, retry = self._claimextra([i[0] for i in decoded], [i[1] for i in decoded])
+        signed = self._stage(txs, [('signrawtransaction', [tx.hex]) for tx in txs], failures)
+        complete = []
+        for tx, result in signed:
+            if result.get('complete'):
+                tx.hex = result['hex']
+                complete.append(tx)
+            else:
+                failures.append((tx, RPCError('Transaction could not be fully signed', 200)))
+        sent = self._stage(complete, [('sendrawtransaction', [tx.hex]) for tx in complete], failures)
+        return sent, failures, stale + retry
+
+    ## Yields (address, amount, txid, error) for every row, error is None for
+    ## payouts that were broadcast and txid is None for ones that weren't.
+    def run(self, rows):
+        rows = iter(rows)
+        spent = []
+        self._snapshot()
+        try:
+            pending = []
+            while True:
+                session.checkcancelled()
+                new = list(itertools.islice(rows, config.PAYOUT_BATCH * self.maxoutputs))
+                valid, invalid = self._validate(new)
+                for address, amount, error in invalid:
+                    yield address, amount, None, error
+                batch = pending + valid
+                if not batch:
+                    if new:
+                        continue
+                    break
+                txs, failed, pending = self._pack(batch, config.PAYOUT_BATCH)
+
+                spent = []
+                sent, failures, retry = self._send(txs)
+                for tx, txid in sent:
+                    spent.extend(i[1] for i in tx.inputs)
+                    if tx.changepos >= 0:
+                        self.coins.append((toSatoshis(tx.vout[tx.changepos]['value']),
+                                           {'txid': txid, 'vout': tx.changepos}))
+                        self.coins.sort(key=lambda i: i[0])
+                    for address, amount, satoshis in tx.payouts:
+                        yield address, amount, txid, None
+                if sent:
+                    # The change just sent may fund them in the next batch.
+                    pending = failed + pending
+                else:
+                    for address, amount in failed:
+                        yield address, amount, None, 'Insufficient funds'
+                for tx, error in failures:
+                    # Failed transactions give their coins back for later ones.
+                    self.coins.extend(tx.inputs)
+                    self.coins.sort(key=lambda i: i[0])
+                    for address, amount, satoshis in tx.payouts:
+                        yield address, amount, None, error.args[0]
+                for tx in reversed(retry):
+                    pending = [(i[0], i[1]) for i in tx.payouts] + pending
+                self._unlock(spent)
+        finally:
+            self._unlock(spent)
+
+def sendpayouts(rows, minconf=1, feerate=None):
+    return Payout(int(minconf), feerate).run(rows)
+
+def payoutcsv(path, minconf=1, display=False):
+    results = []
+    for address, amount, txid, error in sendpayouts(readpayouts(path), minconf):
+        if display:
+            print('%s %s %s' % (address, amount, txid if error is None else 'ERROR: ' + error))
+        results.append((address, amount, txid, error))
+    return results
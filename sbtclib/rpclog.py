@@ -0,0 +1,173 @@
+#
+# Copyright (c) 2016, gijensen
+#
+from __future__ import print_function
+import os, gzip, zlib, json, time, threading, atexit
+from . import srpc
+from . import session
+from .srpc import RPCError
+
+def _key(cmd, params):
+    return json.dumps([cmd, params], sort_keys=True)
+
+## Passes every call through to bitcoind and logs it to a gzipped file, one
+## JSON object per line: m (method), p (params), s (seconds since recording
+## started), t (round trip seconds) and either r (result) or e ([msg, code]).
+## Calls from a batch are logged one by one and share its round trip time.
+##
+## The log is only readable by its owner and calls that can carry wallet
+## secrets (see session.secretcmd) aren't logged at all, so replaying them
+## fails like any other unrecorded call.
+class Recorder(object):
+    offline = False
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.raw = os.fdopen(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb')
+        os.chmod(path, 0o600)
+        self.file = gzip.GzipFile(path, 'wb', fileobj=self.raw)
+        self.started = time.time()
+        self.count = 0
+
+    def _write(self, cmd, params, start, elapsed, result):
+        if session.secretcall(cmd, params):
+            return
+        record = {'m': cmd, 'p': params, 's': round(start - self.started, 6), 't': round(elapsed, 6)}
+        if isinstance(result, RPCError):
+            record['e'] = list(result.args)
+        else:
+            record['r'] = result
+        line = (json.dumps(record, separators=(',', ':')) + '\n').encode('utf-8')
+        with self.lock:
+            if self.file is not None:
+                self.file.write(line)
+                self.count += 1
+
+    def post(self, cmd, params):
+        start = time.time()
+        try:
+            result = srpc._httppost(cmd, params)
+        except RPCError as e:
+            self._write(cmd, params, start, time.time() - start, e)
+            raise
+        self._write(cmd, params, start, time.time() - start, result)
+        return result
+
+    def postbatch(self, calls, strict=True):
+        start = time.time()
+        results = srpc._httppostbatch(calls, False)
+        elapsed = (time.time() - start) / len(calls)
+        for (cmd, params), result in zip(calls, results):
+            self._write(cmd, params, start, elapsed, result)
+        if strict:
+            for result in results:
+                if isinstance(result, RPCError):
+                    raise result
+        return results
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.raw.close()
+                self.file = None
+
+## Serves calls from a recording without touching bitcoind.
+##
+## Responses are indexed by (method, params). Repeated calls get the
+## recorded responses in order and the last one once they run out. With a
+## scale the original round trip time is slept, multiplied by scale.
+##
+## A log cut short (by a crash while recording) is read up to the last
+## complete record and truncated is set.
+class Replayer(object):
+    offline = True
+
+    def __init__(self, path, scale=0):
+        self.path = path
+        self.scale = scale
+        self.lock = threading.Lock()
+        self.index = {}
+        self.cursors = {}
+        self.count = 0
+        self.truncated = False
+        with gzip.open(path, 'rb') as f:
+            try:
+                for line in f:
+                    record = json.loads(line.decode('utf-8'))
+                    self.index.setdefault(_key(record['m'], record['p']), []).append(
+                        (record['t'], record.get('r'), record.get('e')))
+                    self.count += 1
+            except (EOFError, IOError, OSError, ValueError, zlib.error):
+                self.truncated = True
+
+    def _lookup(self, cmd, params):
+        key = _key(cmd, params)
+        with self.lock:
+            responses = self.index.get(key)
+            if responses is None:
+                return 0, None, ['No recorded response for %s %s' % (cmd, json.dumps(params)), 404]
+            cursor = self.cursors.get(key, 0)
+            if cursor < len(responses) - 1:
+                self.cursors[key] = cursor + 1
+            return responses[cursor]
+
+    def post(self, cmd, params):
+        elapsed, result, error = self._lookup(cmd, params)
+        if self.scale:
+            time.sleep(elapsed * self.scale)
+        if error is not None:
+            raise RPCError(*error)
+        return result
+
+    def postbatch(self, calls, strict=True):
+        total = 0
+        results = []
+        for cmd, params in calls:
+            elapsed, result, error = self._lookup(cmd, params)
+            total += elapsed
+            if error is not None:
+                result = RPCError(*error)
+                if strict:
+                    raise result
+            results.append(result)
+        if self.scale:
+            time.sleep(total * self.scale)
+        return results
+
+    def close(self):
+        pass
+
+_active = None
+
+def _settransport(transport):
+    global _active
+    if _active is not None:
+        _active.close()
+    _active = transport
+    srpc.settransport(transport)
+    # Cached answers came from the previous transport.
+    srpc.cleartipmemo()
+
+def rpcrecord(path, display=False):
+    recorder = Recorder(path)
+    _settransport(recorder)
+    if display: print('Recording RPC calls to %s.' % path)
+    return recorder
+
+def rpcreplay(path, scale=0, display=False):
+    replayer = Replayer(path, float(scale))
+    _settransport(replayer)
+    if display:
+        print('Replaying %d RPC calls from %s.' % (replayer.count, path))
+        if replayer.truncated:
+            print('The log is truncated, later calls are missing.')
+    return replayer
+
+## Back to talking to bitcoind, finishing any recording.
+def rpclive(display=False):
+    _settransport(None)
+    if display: print('Using bitcoind for RPC calls.')
+
+atexit.register(lambda: _active is not None and _active.close())
@@ -2,13 +2,20 @@
 # Copyright (c) 2016, gijensen
 #
 from __future__ import print_function
-import time, sys, select
+import time, sys, select, threading
 from . import config
+from . import session
 from .srpc import *
+from .headers import syncheaders, headercache
+from .blockstats import chainstats
+from .feeestimator import feeupdate, localfee
+from .payout import payoutcsv
+from .walletsync import syncwallet, walletbalance, wallettxs
+from .mempoolgraph import mempoolsync, ancestors, descendants, mempoolpackage, mempoolconflicts
+from .rpclog import rpcrecord, rpcreplay, rpclive
 
 # TODO gettxfeepaid function
 # TODO exec from file function
-# TODO prompt command history, arrow key support
 # TODO Plugin support, .so, and .py files
 
 ## For Python 2.x compatibility.
@@ -35,9 +42,15 @@ def printverificationprogress(progress):
     sys.stdout.write('\r[%-50s] %5.2f%%' % ('x'*int(progress/2), progress))
     sys.stdout.flush()
 
+## Stops on any input, or when killed if it's running as a background job.
+def stopRequested():
+    if session.currentjob() is not None:
+        return session.cancelled()
+    return getInput() != None
+
 def watchverificationprogress(display=True):
     progress = 0
-    while progress < 100 and getInput() == None:
+    while progress < 100 and not stopRequested():
         result = rpccommand('getblockchaininfo')
         progress = round(float(result['verificationprogress']) * 100, 2)
         printverificationprogress(progress)
@@ -54,18 +67,86 @@ def getExtHelp(display=True):
         else:
             print(' %s (%s args)' % (i, ext_commands[i][0]))
 
+def startJob(cmd, display=True):
+    cmd = list(cmd)
+    def run():
+        if not processCmd(list(cmd)):
+            print('Unknown command: ' + cmd[0])
+    job = session.startjob(' '.join(cmd), run)
+    if display: print('[%d] %s' % (job.id, job.cmd))
+    return job
+
+def listJobs(display=True):
+    result = session.jobs()
+    if display:
+        for job in result:
+            print('[%d] %s  %s' % (job.id, job.status, job.cmd))
+            job.reported = not job.running()
+    return result
+
+## Prints what a job wrote so far, finished jobs are forgotten afterwards.
+def jobOutput(jobid, display=True):
+    job = session.getjob(jobid)
+    if job is None:
+        print('No such job: %s' % jobid)
+        return None
+    if display:
+        sys.stdout.write(job.text())
+        if job.output and not job.text().endswith('\n'):
+            print()
+    if not job.running():
+        session.removejob(jobid)
+    return job.text()
+
+def killJob(jobid, display=True):
+    job = session.getjob(jobid)
+    if job is None:
+        print('No such job: %s' % jobid)
+        return None
+    job.cancel.set()
+    return job
+
+def showHistory(count=20, display=True):
+    result = session.History().lines[-int(count):]
+    if display:
+        for i in result:
+            print(i)
+    return result
+
 sbtc_commands = {
     'loadconfig':[[0, 1], config.loadconfig],
     'exthelp':[[0], getExtHelp],
     'rpchelp':[[0], getRPCHelp],
     'eval':[[-1], lambda expr, display=True:displayResult(eval(' '.join(expr))) if display else eval(' '.join(expr))],
     'exec':[[-1], lambda expr, display=False:exec2(' '.join(expr))],
-    'copyright':[[0], lambda display=True:print('Copyright (c) 2016, gijensen')]
+    'copyright':[[0], lambda display=True:print('Copyright (c) 2016, gijensen')],
+    'history':[[0, 1], showHistory],
+    'bg':[[-1], startJob],
+    'jobs':[[0], listJobs],
+    'output':[[1], jobOutput],
+    'kill':[[1], killJob]
 }
 
 ext_commands = {
     'watchprogress':[[0], watchverificationprogress],
-    'rpcraw':[[-1], lambda x, display=False:rpccommand(x[0], x[1:], display)]
+    'rpcraw':[[-1], lambda x, display=False:rpccommand(x[0], x[1:], display)],
+    'syncheaders':[[0], syncheaders],
+    'headercache':[[0, 1], headercache, '[enable=True]'],
+    'chainstats':[[2, 3], chainstats, '<start> <end> [window]'],
+    'feeupdate':[[0], feeupdate],
+    'localfee':[[1, 2], localfee, '<target> [confidence=0.85]'],
+    'payout':[[1, 2], payoutcsv, '<csvfile> [minconf=1]'],
+    'walletsync':[[0], syncwallet],
+    'walletbalance':[[0, 1], walletbalance, '[minconf=1]'],
+    'wallettxs':[[0, 1, 2], wallettxs, '[cursor=0] [count=10]'],
+    'mempoolsync':[[0], mempoolsync],
+    'ancestors':[[1], ancestors, '<txid>'],
+    'descendants':[[1], descendants, '<txid>'],
+    'mempoolpackage':[[1], mempoolpackage, '<txid>'],
+    'mempoolconflicts':[[1], mempoolconflicts, '<hexstring|txid>'],
+    'rpcrecord':[[1], rpcrecord, '<file>'],
+    'rpcreplay':[[1, 2], rpcreplay, '<file> [scale=0]'],
+    'rpclive':[[0], rpclive]
 }
 
 ## ["command", [no. of args (-1, no limit)], function, optional helptext]
@@ -83,27 +164,24 @@ def generateCmdHelp(commands):
     return cmdHelp
 
 def processCmd(cmd, commands=None):
-    cmd[0] = cmd[0].lower()
-
-    if not commands:
-        commands = config.commands
-
-    if cmd[0] in config.ALIASES:
-        cmd[0] = config.ALIASES[cmd[0]]
-
-    if cmd[0] in commands:
-        args = len(cmd)-1
-        if args in commands[cmd[0]][0]: 
-            if args == 0:
-                commands[cmd[0]][1](display=True)
-            else:
-                commands[cmd[0]][1](*cmd[1:], display=True)
-            return True
-        elif commands[cmd[0]][0][0] == -1:
-            commands[cmd[0]][1](cmd[1:], display=True)
-            return True
-        else:
-            print('Error: Expected %s args, recieved %d.' % (commands[cmd[0]][0], args))
+    name = cmd[0].lower()
+    name = config.ALIASES.get(name, name)
+    cmd[0] = name
+
+    entry = (commands or config.commands).get(name)
+    if entry is None:
+        return False
+
+    arity, func = entry[0], entry[1]
+    args = len(cmd)-1
+    if args in arity:
+        func(*cmd[1:], display=True)
+        return True
+    elif arity[0] == -1:
+        func(cmd[1:], display=True)
+        return True
+    else:
+        print('Error: Expected %s args, recieved %d.' % (arity, args))
 
     return False
 
@@ -157,106 +235,227 @@ def _find_getch():
 
 getch = _find_getch()
 
-def handleInput(prefix=''):
+## The line being edited, so other threads can redraw the prompt.
+class _InputLine(object):
+    def __init__(self):
+        self.active = False
+        self.prefix = ''
+        self.result = ''
+        self.i = 0
+        self.lock = threading.RLock()
+
+    def redraw(self):
+        with self.lock:
+            if not self.active:
+                return
+            sys.stdout.write('\r\x1b[K%s%s%s' % (self.prefix, self.result, '\b'*(len(self.result)-self.i)))
+            sys.stdout.flush()
+
+inputline = _InputLine()
+
+## ctrl+r, returns (line, accepted). accepted is True if enter was pressed.
+def reverseSearch(history, line):
+    query = ''
+    pos = len(history)
+    match = line
+
+    while True:
+        sys.stdout.write('\r\x1b[K(reverse-i-search)`%s\': %s' % (query, match))
+        sys.stdout.flush()
+        char = getch()
+
+        if char == '\r':
+            return match, True
+        elif char in ('\x03', '\x07'): # ctrl+c, ctrl+g
+            return line, False
+        elif char == '\x12': # ctrl+r, next older match
+            found = history.search(query, pos)
+            if found is not None:
+                pos = found
+                match = history[pos]
+            continue
+        elif char == '\x1b':
+            getch()
+            getch()
+            return match, False
+        elif char == '\x7f':
+            query = query[:-1]
+        elif char >= ' ':
+            query += char
+        else:
+            return match, False
+
+        found = history.search(query, len(history))
+        if found is not None:
+            pos = found
+            match = history[pos]
+
+def handleInput(prefix='', history=None):
     char = ''
     result = ''
     i = 0
+    histpos = len(history) if history is not None else 0
+    saved = ''
 
-    sys.stdout.write(prefix)
+    with inputline.lock:
+        inputline.active = True
+        inputline.prefix = prefix
+        inputline.result = ''
+        inputline.i = 0
+        sys.stdout.write(prefix)
 
     while True:
+        inputline.result = result
+        inputline.i = i
         sys.stdout.flush()
         char = getch()
 
-        if char == '\r':
-            sys.stdout.write('\r\n')
-            return str(result)
-        elif char == '\x1b':
-            getch() # Always "["
-            arrow = getch() # A up, B down, C right, D left
-            if arrow == 'C':
-                if i != len(result):
-                    sys.stdout.write(result[i])
-                    i += 1
-            elif arrow == 'D':
+        with inputline.lock:
+            if char == '\r':
+                sys.stdout.write('\r\n')
+                inputline.active = False
+                return str(result)
+            elif char == '\x1b':
+                getch() # Always "["
+                arrow = getch() # A up, B down, C right, D left
+                if arrow == 'C':
+                    if i != len(result):
+                        sys.stdout.write(result[i])
+                        i += 1
+                elif arrow == 'D':
+                    if i > 0:
+                        sys.stdout.write('\b')
+                        i -= 1
+                elif arrow in ('A', 'B') and history is not None:
+                    if histpos == len(history):
+                        saved = result
+                    if arrow == 'A' and histpos > 0:
+                        histpos -= 1
+                    elif arrow == 'B' and histpos < len(history):
+                        histpos += 1
+                    result = history[histpos] if histpos < len(history) else saved
+                    i = len(result)
+                    inputline.result = result
+                    inputline.i = i
+                    inputline.redraw()
+            elif char == '\x12' and history is not None: # ctrl+r
+                result, accepted = reverseSearch(history, result)
+                i = len(result)
+                inputline.result = result
+                inputline.i = i
+                inputline.redraw()
+                if accepted:
+                    sys.stdout.write('\r\n')
+                    inputline.active = False
+                    return str(result)
+            elif char == '\x7f': # backspace
                 if i > 0:
-                    sys.stdout.write('\b')
+                    end = result[i:]
+                    result = result[:i-1] + end
+                    end += ' '
+                    sys.stdout.write('\b%s%s' % (end, '\b'*len(end)))
                     i -= 1
-        elif char == '\x7f': # backspace
-            if i > 0:
-                end = result[i:]
-                result = result[:i-1] + end
-                end += ' '
-                sys.stdout.write('\b%s%s' % (end, '\b'*len(end)))
-                i -= 1
-        elif char == '\x03': # ctrl+c
-            exit(1)
-        elif char == '\t':
-            if len(result.strip()) == 0 or i != len(result): continue
-            cmd = result.split()[0]
-            if len(cmd) != len(result): continue # continue if tabbing a param
-
-            hits = []
-            for ii in config.commands:
-                if len(cmd) <= len(ii) and ii[:len(cmd)] == cmd:
-                    if len(hits) == 1:
-                        print()
-                        print(hits[0])
-                        print(ii)
-                    elif len(hits) > 1:
-                        print(ii)
-                    hits.append(ii)
-            if len(hits) == 1:
-                result = hits[0] + ' '
-                i = len(result)
-                sys.stdout.write(result[len(cmd):])
-            elif len(hits) > 1:
-                print()
-                sys.stdout.write(prefix+result)
-                same = ''
-                for ii in enumerate(hits[0][i:], i):
-                    for iii in hits:
-                        if ii[0] == len(iii) or iii[ii[0]] != ii[1]:
-                            result += same
-                            i += len(same)
-                            sys.stdout.write(same)
-                            same = None
+            elif char == '\x03': # ctrl+c
+                exit(1)
+            elif char == '\t':
+                if len(result.strip()) == 0 or i != len(result): continue
+                cmd = result.split()[0]
+                if len(cmd) != len(result): continue # continue if tabbing a param
+
+                hits = []
+                for ii in config.commands:
+                    if len(cmd) <= len(ii) and ii[:len(cmd)] == cmd:
+                        if len(hits) == 1:
+                            print()
+                            print(hits[0])
+                            print(ii)
+                        elif len(hits) > 1:
+                            print(ii)
+                        hits.append(ii)
+                if len(hits) == 1:
+                    result = hits[0] + ' '
+                    i = len(result)
+                    sys.stdout.write(result[len(cmd):])
+                elif len(hits) > 1:
+                    print()
+                    sys.stdout.write(inputline.prefix+result)
+                    same = ''
+                    for ii in enumerate(hits[0][i:], i):
+                        for iii in hits:
+                            if ii[0] == len(iii) or iii[ii[0]] != ii[1]:
+                                result += same
+                                i += len(same)
+                                sys.stdout.write(same)
+                                same = None
+                                break
+                        if same == None:
                             break
-                    if same == None:
-                        break
-                    else:
-                        same += ii[1]
-        elif i == len(result):
-            sys.stdout.write(char)
-            result += char
-            i += 1
-        else:
-            end = char+result[i:]
-            sys.stdout.write(end+'\b'*(len(end)-1))
-            result = result[:i]+end
-            i += 1
+                        else:
+                            same += ii[1]
+            elif i == len(result):
+                sys.stdout.write(char)
+                result += char
+                i += 1
+            else:
+                end = char+result[i:]
+                sys.stdout.write(end+'\b'*(len(end)-1))
+                result = result[:i]+end
+                i += 1
+
+def promptPrefix():
+    if tipstatus is not None and tipstatus.height is not None:
+        return '[%d] > ' % tipstatus.height
+    return '> '
+
+def updatePrompt():
+    with inputline.lock:
+        inputline.prefix = promptPrefix()
+        inputline.redraw()
+
+def runCmd(cmd, cmdHelp=None):
+    # FIXME Handle Exceptions properly (Catch TypeError at least)
+    try:
+        if not processCmd(cmd) and cmdHelp:
+            print(cmdHelp)
+    except RPCError as rpce:
+        msg, code = rpce.args
+        print('RPCError (HTTP %d): %s' % (code, msg))
+    except Exception as e:
+        print('Error running command: %s' % e)
+
+tipstatus = None
 
 #TODO Allow multi-line commands in prompt (for exec)
 def prompt():
-    global input
+    global input, tipstatus
     cmdHelp = generateCmdHelp(sbtc_commands)
     cmd = ''
+    history = session.History()
 
     print('%s by %s' % (config.VERSION, config.CREDITS))
 
-    while cmd != 'exit':
-        # FIXME Handle Exceptions properly (Catch TypeError at least)
-        if len(cmd) > 0:
-            cmd = joinQuotes(cmd.split(' '))
-            try:
-                if not processCmd(cmd):
-                    print(cmdHelp)
-            except RPCError as rpce:
-                msg, code = rpce.args
-                print('RPCError (HTTP %d): %s' % (code, msg))
-            except Exception as e:
-                print('Error running command: %s' % e)
-        else:
-            print(cmdHelp)
+    stdout = sys.stdout
+    sys.stdout = session.ThreadOutput(stdout)
+    if config.PROMPT_TIP:
+        tipstatus = session.TipStatus(updatePrompt)
+        tipstatus.start()
+
+    try:
+        while cmd != 'exit':
+            if len(cmd) > 0:
+                history.add(cmd)
+                runCmd(joinQuotes(cmd.split(' ')), cmdHelp)
+                if tipstatus is not None:
+                    tipstatus.refresh()
+            else:
+                print(cmdHelp)
+
+            for job in session.finishedjobs():
+                print('[%d] %s  %s' % (job.id, job.status, job.cmd))
 
-        cmd = handleInput('> ').strip()
+            cmd = handleInput(promptPrefix(), history).strip()
+    finally:
+        if tipstatus is not None:
+            tipstatus.stop()
+            tipstatus = None
+        sys.stdout = stdout
@@ -0,0 +1,280 @@
+#
+# Copyright (c) 2016, gijensen
+#
+from __future__ import print_function
+import os, threading
+from . import config
+from . import srpc
+
+## Commands whose arguments (or output) can hold wallet secrets, they are
+## never kept in the history.
+SECRET_COMMANDS = set([
+    'encryptwallet', 'walletpassphrase', 'walletpassphrasechange',
+    'importprivkey', 'dumpprivkey', 'importmulti', 'sethdseed',
+    'signrawtransactionwithkey', 'exec', 'eval'
+])
+## Commands running the rest of the line as another command.
+WRAPPER_COMMANDS = ('bg', 'rpcraw')
+
+def _secret(name, nargs):
+    name = name.lower()
+    name = config.ALIASES.get(name, name)
+    # Anything past the hex string may be (or be followed by) private keys.
+    if name == 'signrawtransaction':
+        return nargs > 1
+    return name in SECRET_COMMANDS
+
+## True for console lines that must not be kept anywhere.
+def secretcmd(line):
+    words = line.split()
+    while words and words[0].lower() in WRAPPER_COMMANDS:
+        words = words[1:]
+    if not words:
+        return False
+    return _secret(words[0], len(words) - 1)
+
+## The same for an RPC call.
+def secretcall(method, params):
+    return _secret(method, len(params))
+
+## Command history, persisted one command per line in <datadir>/sbtc.history.
+## The file is only readable by its owner and commands that can carry wallet
+## secrets are left out, see secretcmd().
+class History(object):
+    def __init__(self, path=None, size=None):
+        if path is None:
+            path = config.DATADIR + '/sbtc.history'
+        if size is None:
+            size = config.HISTORY_SIZE
+        self.path = path
+        self.size = size
+        self.lines = []
+        try:
+            with open(path, 'r') as f:
+                lines = [i.rstrip('\n') for i in f if i.strip()]
+        except (IOError, OSError):
+            return
+        self.lines = [i for i in lines if not secretcmd(i)][-size:]
+        try:
+            os.chmod(path, 0o600)
+            # Scrub secrets written by older versions.
+            if len(self.lines) < len(lines[-size:]):
+                self._write(self.lines, False)
+        except (IOError, OSError):
+            pass
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __getitem__(self, i):
+        return self.lines[i]
+
+    def _write(self, lines, append):
+        flags = os.O_WRONLY | os.O_CREAT | (os.O_APPEND if append else os.O_TRUNC)
+        with os.fdopen(os.open(self.path, flags, 0o600), 'w') as f:
+            f.write(''.join(i + '\n' for i in lines))
+
+    def add(self, line):
+        if not line or (self.lines and self.lines[-1] == line) or secretcmd(line):
+            return
+        self.lines.append(line)
+        try:
+            if len(self.lines) > self.size * 2:
+                # Rewrite now and then so the file doesn't grow forever.
+                self.lines = self.lines[-self.size:]
+                self._write(self.lines, False)
+            else:
+                self._write([line], True)
+        except (IOError, OSError):
+            pass
+
+    ## Index of the newest entry before start containing text, or None.
+    def search(self, text, start=None):
+        if start is None:
+            start = len(self.lines)
+        for i in range(min(start, len(self.lines)) - 1, -1, -1):
+            if text in self.lines[i]:
+                return i
+        return None
+
+## Raised by checkcancelled() to unwind a killed job.
+class Cancelled(Exception):
+    pass
+
+## A console command running in a background thread. Its output is captured
+## by ThreadOutput instead of going to the terminal.
+class Job(object):
+    def __init__(self, jobid, cmd, func):
+        self.id = jobid
+        self.cmd = cmd
+        self.status = 'Running'
+        self.output = []
+        self.cancel = threading.Event()
+        self.stopped = False
+        self.reported = False
+        self.thread = threading.Thread(target=self._run, args=(func,))
+        self.thread.daemon = True
+
+    def _run(self, func):
+        try:
+            func()
+            self.status = 'Killed' if self.stopped else 'Done'
+        except Cancelled:
+            self.status = 'Killed'
+        except srpc.RPCError as rpce:
+            msg, code = rpce.args
+            print('RPCError (HTTP %d): %s' % (code, msg))
+            self.status = 'Failed'
+        except Exception as e:
+            print('Error running command: %s' % e)
+            self.status = 'Failed'
+
+    def running(self):
+        return self.thread.is_alive()
+
+    def text(self):
+        return ''.join(self.output)
+
+_jobs = {}
+_jobthreads = {}
+_jobslock = threading.Lock()
+_nextjob = 1
+
+def startjob(cmd, func):
+    global _nextjob
+    with _jobslock:
+        job = Job(_nextjob, cmd, func)
+        _nextjob += 1
+        _jobs[job.id] = job
+        _jobthreads[job.thread] = job
+    job.thread.start()
+    return job
+
+def getjob(jobid):
+    return _jobs.get(int(jobid))
+
+def jobs():
+    return [_jobs[i] for i in sorted(_jobs)]
+
+## Jobs that finished since the last call.
+def finishedjobs():
+    out = []
+    for job in jobs():
+        if not job.running() and not job.reported:
+            job.reported = True
+            out.append(job)
+    return out
+
+def removejob(jobid):
+    with _jobslock:
+        job = _jobs.pop(int(jobid), None)
+        if job is not None:
+            _jobthreads.pop(job.thread, None)
+    return job
+
+## The job running in the current thread, if any.
+def currentjob():
+    return _jobthreads.get(threading.current_thread())
+
+## Long running commands should check this and stop when it's True, the job
+## then counts as killed.
+def cancelled():
+    job = currentjob()
+    if job is None or not job.cancel.is_set():
+        return False
+    job.stopped = True
+    return True
+
+## For loops that can't return early with a sensible result.
+def checkcancelled():
+    if cancelled():
+        raise Cancelled()
+
+## sys.stdout replacement sending output written by job threads to the job.
+class ThreadOutput(object):
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.RLock()
+
+    def write(self, data):
+        job = currentjob()
+        if job is not None:
+            job.output.append(data)
+        else:
+            with self.lock:
+                self.stream.write(data)
+
+    def flush(self):
+        if currentjob() is None:
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+## Tip height for the prompt, kept current by a background thread.
+##
+## While the header cache is enabled and its follower is current the height
+## is read from the store every HEADER_POLL_INTERVAL without any RPC.
+## Otherwise getbestblockhash is only polled every PROMPT_POLL_INTERVAL, or
+## when refresh() is called after a command, and getblockcount is only asked
+## when the hash changes.
+class TipStatus(object):
+    def __init__(self, onchange=None, interval=None):
+        self.interval = interval
+        self.onchange = onchange
+        self.height = None
+        self.blkhash = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def poll(self):
+        store = srpc._headerstore
+        if store is not None and store.current():
+            height = store.height()
+        else:
+            blkhash = srpc.rpccommand('getbestblockhash')
+            if blkhash == self.blkhash:
+                return self.height
+            self.blkhash = blkhash
+            height = srpc.rpccommand('getblockcount')
+        if height != self.height:
+            self.height = height
+            if self.onchange is not None:
+                self.onchange()
+        return height
+
+    def _wait(self):
+        if self.interval is not None:
+            return self.interval
+        if srpc._headerstore is not None and srpc._headerstore.current():
+            return config.HEADER_POLL_INTERVAL
+        return config.PROMPT_POLL_INTERVAL
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.poll()
+            except Exception:
+                pass
+            self._wake.wait(self._wait())
+            self._wake.clear()
+
+    ## Poll again now instead of waiting for the interval.
+    def refresh(self):
+        self._wake.set()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._wake.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._wake.set()
+            self._thread = None
@@ -3,7 +3,7 @@
 # Copyright (c) 2016, gijensen
 #
 from __future__ import print_function
-import requests, json, os, psutil
+import requests, json, os, psutil, threading, time
 from . import config
 
 # NOTE No idea if this works on OSs that aren't Linux
@@ -30,11 +30,59 @@ def bitcoindIsSafe():
 class RPCError(Exception):
     pass
 
-def rpccommand(cmd, params=[], display=False):
-    if not config.IGNORE_BITCOIND_UID and not bitcoindIsSafe():
-        print('!!WARNING!! bitcoind was started by a different UID.')
-        return
-
+## Read-only methods that may share a single in-flight request.
+SINGLEFLIGHT_METHODS = set([
+    'getinfo', 'getpeerinfo', 'getblockchaininfo', 'getrawtransaction',
+    'getblockcount', 'getbestblockhash', 'getblock', 'getblockheader',
+    'getblockhash', 'getdifficulty', 'getmempoolinfo', 'getrawmempool',
+    'gettxout', 'gettxoutproof', 'verifytxoutproof', 'getchaintips',
+    'gettxoutsetinfo', 'getmininginfo', 'getnetworkhashps',
+    'getconnectioncount', 'getnettotals', 'getnetworkinfo',
+    'decoderawtransaction', 'decodescript', 'validateaddress', 'estimatefee',
+    'estimatepriority', 'estimatesmartfee', 'estimatesmartpriority', 'help'
+])
+
+## Methods whose result only changes when the tip changes. getbestblockhash
+## is the probe that tells when that happens so it is never memoized, nor is
+## getblockcount which costs as much as the probe.
+TIP_METHODS = set([
+    'getblockchaininfo', 'getdifficulty', 'getchaintips', 'getmininginfo',
+    'getnetworkhashps', 'gettxoutsetinfo'
+])
+
+class _Flight(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+_flights = {}
+_tipmemo = {}
+## Last getbestblockhash seen and a counter bumped whenever the memo is
+## dropped, so answers fetched for an older tip are never memoized.
+_tip = None
+_tipgen = 0
+## True while something (the header cache follower) polls getbestblockhash
+## in the background, memo hits then don't need their own tip probe.
+_tipfollowed = False
+_flightlock = threading.Lock()
+
+## Must be called with _flightlock held.
+def _droptipmemo(tip=None):
+    global _tip, _tipgen
+    _tipmemo.clear()
+    _tip = tip
+    _tipgen += 1
+
+def cleartipmemo():
+    with _flightlock:
+        _droptipmemo()
+
+def settipfollowed(followed):
+    global _tipfollowed
+    _tipfollowed = followed
+
+def _httppost(cmd, params):
     url = "http://localhost:%d/" % config.RPCPORT
     headers = {'content-type': 'application/json'}
 
@@ -46,9 +94,7 @@ def rpccommand(cmd, params=[], display=False):
     }
     response = requests.post(url, data=json.dumps(payload), headers=headers, auth=(config.RPCUSER, config.RPCPASS))
     if response.status_code == 200:
-        result = response.json()['result']
-        if display: displayResult(result)
-        return result
+        return response.json()['result']
     else:
         try:
             response_json = response.json()
@@ -58,6 +104,150 @@ def rpccommand(cmd, params=[], display=False):
 
         raise RPCError(response_json['error']['message'], response.status_code)
 
+## Send several calls in one JSON-RPC batch, calls is a list of (cmd, params).
+## Results are returned in the same order as calls. If strict is False failed
+## calls return an RPCError in place of their result instead of raising.
+def _httppostbatch(calls, strict=True):
+    url = "http://localhost:%d/" % config.RPCPORT
+    headers = {'content-type': 'application/json'}
+
+    payload = [{
+        "method": cmd,
+        "params": params,
+        "jsonrpc": "2.0",
+        "id": i,
+    } for i, (cmd, params) in enumerate(calls)]
+    response = requests.post(url, data=json.dumps(payload), headers=headers, auth=(config.RPCUSER, config.RPCPASS))
+    try:
+        response_json = response.json()
+    except:
+        e = 'Error code %d when connecting via RPC.' % response.status_code
+        raise RPCError(e, response.status_code)
+
+    if type(response_json) != list:
+        raise RPCError(response_json['error']['message'], response.status_code)
+
+    results = [None]*len(calls)
+    for i in response_json:
+        if i.get('error'):
+            error = RPCError(i['error']['message'], response.status_code)
+            if strict:
+                raise error
+            results[i['id']] = error
+        else:
+            results[i['id']] = i['result']
+    return results
+
+## Replaces the HTTP calls when set, see sbtclib.rpclog. It needs post(cmd,
+## params), postbatch(calls, strict) and an offline flag that is True when
+## no bitcoind is involved.
+_transport = None
+
+def settransport(transport):
+    global _transport
+    _transport = transport
+
+def _rpcpost(cmd, params):
+    transport = _transport
+    if transport is not None:
+        return transport.post(cmd, params)
+    return _httppost(cmd, params)
+
+def _rpcpostbatch(calls, strict=True):
+    transport = _transport
+    if transport is not None:
+        return transport.postbatch(calls, strict)
+    return _httppostbatch(calls, strict)
+
+def _bitcoindOk():
+    if config.IGNORE_BITCOIND_UID or (_transport is not None and _transport.offline):
+        return True
+    if bitcoindIsSafe():
+        return True
+    print('!!WARNING!! bitcoind was started by a different UID.')
+    return False
+
+def rpcbatch(calls, strict=True, display=False):
+    if not _bitcoindOk():
+        return
+
+    if len(calls) == 0:
+        return []
+
+    result = _rpcpostbatch(calls, strict)
+    if display: displayResult(result)
+    return result
+
+## Must be called with _flightlock held.
+def _memoize(cmd, key, result, started, gen):
+    if cmd == 'getbestblockhash':
+        # A new tip invalidates every tip-dependent answer.
+        if result != _tip:
+            _droptipmemo(result)
+    elif config.RPC_TIPMEMO_TTL and cmd in TIP_METHODS and gen == _tipgen:
+        _tipmemo[key] = (started, result)
+
+def _getmemo(key, now):
+    with _flightlock:
+        memo = _tipmemo.get(key)
+        if memo and now - memo[0] < config.RPC_TIPMEMO_TTL:
+            return memo
+        return None
+
+## Identical concurrent calls wait on the first one and share its result.
+## Shared results are the same object for every caller, don't modify them.
+##
+## Memoized answers are only served once getbestblockhash confirms the tip
+## hasn't moved, unless the header cache follower is already checking it.
+def _sharedcall(cmd, params):
+    key = (cmd, json.dumps(params))
+    now = time.time()
+    if config.RPC_TIPMEMO_TTL and cmd in TIP_METHODS and _getmemo(key, now):
+        if not _tipfollowed:
+            _sharedcall('getbestblockhash', [])
+        memo = _getmemo(key, now)
+        if memo:
+            return memo[1]
+
+    with _flightlock:
+        gen = _tipgen
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+
+    if not leader:
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    try:
+        flight.result = _rpcpost(cmd, params)
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        with _flightlock:
+            del _flights[key]
+            if flight.error is None:
+                _memoize(cmd, key, flight.result, now, gen)
+        flight.done.set()
+
+    return flight.result
+
+def rpccommand(cmd, params=[], display=False):
+    if not _bitcoindOk():
+        return
+
+    if config.RPC_SINGLEFLIGHT and cmd in SINGLEFLIGHT_METHODS:
+        result = _sharedcall(cmd, params)
+    else:
+        result = _rpcpost(cmd, params)
+
+    if display: displayResult(result)
+    return result
+
 ## Convert a string to a boolean
 def toBool(v):
     if type(v) == bool:
@@ -116,12 +306,176 @@ def displayResult(result, exclude=[]):
     else:
         print(repr(result))
 
-def getinfo(display=False):
-    return rpccommand('getinfo', [], display)
+## Parameter coercions. Values from the console are always strings, library
+## callers may pass the real types (or parsed JSON) directly.
+try: _strtypes = (str, unicode)
+except NameError: _strtypes = (str,)
+
+def _json(v):
+    return json.loads(v) if isinstance(v, _strtypes) else v
 
-def getpeerinfo(display=False):
-    return rpccommand('getpeerinfo', [], display)
+def _str(v):
+    return v
 
+COERCIONS = {
+    'str': _str,
+    'int': int,
+    'float': float,
+    'bool': toBool,
+    'bool01': lambda v: int(toBool(v)),
+    'json': _json
+}
+
+## Every wrapped RPC: (method, [(param, type[, default]), ...]).
+## Params without a default are required. A param with a default of None is
+## left out, along with every param after it, when it and all of those are at
+## their defaults. If a later param is given it is sent as null instead.
+RPC_SCHEMA = [
+    ('getinfo', []),
+    ('getblockcount', []),
+    ('getbestblockhash', []),
+    ('getblock', [('blkhash', 'str'), ('verbose', 'bool', True)]),
+    ('getblockheader', [('blkhash', 'str'), ('verbose', 'bool', True)]),
+    ('getdifficulty', []),
+    ('getmempoolinfo', []),
+    ('getrawmempool', [('verbose', 'bool', False)]),
+    ('gettxout', [('txid', 'str'), ('n', 'int'), ('inclmempl', 'bool', True)]),
+    ('ping', []),
+    ('gettxoutproof', [('txids', 'json'), ('blkhash', 'str', None)]),
+    ('getchaintips', []),
+    ('getblockhash', [('blkid', 'int')]),
+    ('getpeerinfo', []),
+    ('getrawtransaction', [('txid', 'str'), ('verbose', 'bool01', False)]),
+    ('createrawtransaction', [('txs', 'json'), ('outs', 'json')]),
+    ('gettxoutsetinfo', []),
+    ('verifychain', [('chklvl', 'int', 3), ('numblks', 'int', 388)]),
+    ('verifytxoutproof', [('proof', 'str')]),
+    ('stop', []),
+    ('generate', [('numblks', 'int')]),
+    ('getgenerate', []),
+    ('setgenerate', [('gen', 'bool'), ('genproclimit', 'int', None)]),
+    ('getblocktemplate', [('jsonReqObj', 'json', None)]),
+    ('getmininginfo', []),
+    ('getnetworkhashps', [('blocks', 'int', 120), ('height', 'int', -1)]),
+    ('prioritisetransaction', [('txid', 'str'), ('priority_d', 'int'), ('fee_d', 'int')]),
+    ('submitblock', [('data', 'str'), ('jsonParamsObj', 'json', None)]),
+    ('addnode', [('node', 'str'), ('cmd', 'str')]),
+    ('clearbanned', []),
+    ('disconnectnode', [('node', 'str')]),
+    ('getaddednodeinfo', [('dns', 'bool'), ('node', 'str', None)]),
+    ('getconnectioncount', []),
+    ('getnettotals', []),
+    ('getnetworkinfo', []),
+    ('listbanned', []),
+    ('setban', [('ip', 'str'), ('cmd', 'str'), ('bantime', 'int', 0), ('absolute', 'bool', False)]),
+    ('signrawtransaction', [('hexstring', 'str'), ('prevtxs', 'json', None), ('privatekeys', 'json', None), ('sighashtype', 'str', 'ALL')]),
+    ('decoderawtransaction', [('hexstr', 'str')]),
+    ('decodescript', [('hexraw', 'str')]),
+    ('fundrawtransaction', [('hexstr', 'str'), ('inclwatch', 'bool')]),
+    ('sendrawtransaction', [('hexstr', 'str'), ('allowhighfees', 'bool', False)]),
+    ('createmultisig', [('nreq', 'int'), ('keys', 'json')]),
+    ('estimatefee', [('nblks', 'int')]),
+    ('estimatepriority', [('nblks', 'int')]),
+    ('estimatesmartfee', [('nblks', 'int')]),
+    ('estimatesmartpriority', [('nblks', 'int')]),
+    ('validateaddress', [('addr', 'str')]),
+    ('verifymessage', [('addr', 'str'), ('sig', 'str'), ('msg', 'str')]),
+    ('abandontransaction', [('txid', 'str')]),
+    ('addmultisigaddress', [('nreq', 'int'), ('keys', 'json'), ('account', 'str', '')]),
+    ('backupwallet', [('dest', 'str')]),
+    ('dumpprivkey', [('addr', 'str')]),
+    ('dumpwallet', [('filen', 'str')]),
+    ('encryptwallet', [('passphr', 'str')]),
+    ('getaccount', [('addr', 'str')]),
+    ('getaccountaddress', [('acc', 'str')]),
+    ('getaddressesbyaccount', [('acc', 'str')]),
+    ('getbalance', [('acc', 'str', '*'), ('minconf', 'int', 1), ('inclwatch', 'bool', False)]),
+    ('getnewaddress', [('acc', 'str', '')]),
+    ('getrawchangeaddress', []),
+    ('getreceivedbyaccount', [('acc', 'str'), ('minconf', 'int', 1)]),
+    ('getreceivedbyaddress', [('addr', 'str'), ('minconf', 'int', 1)]),
+    ('gettransaction', [('txid', 'str'), ('inclwatch', 'bool', False)]),
+    ('getunconfirmedbalance', []),
+    ('getwalletinfo', []),
+    ('importaddress', [('addr', 'str'), ('label', 'str', ''), ('rescan', 'bool', True), ('p2sh', 'bool', False)]),
+    ('importprivkey', [('privkey', 'str'), ('label', 'str', ''), ('rescan', 'bool', True)]),
+    ('importpubkey', [('pubkey', 'str'), ('label', 'str', ''), ('rescan', 'bool', True)]),
+    ('importwallet', [('filen', 'str')]),
+    ('keypoolrefill', [('size', 'int', 100)]),
+    ('listaccounts', [('minconf', 'int', 1), ('inclwatch', 'bool', False)]),
+    ('listaddressgroupings', []),
+    ('listlockunspent', []),
+    ('listreceivedbyaccount', [('minconf', 'int', 1), ('inclempty', 'bool', False), ('inclwatch', 'bool', False)]),
+    ('listreceivedbyaddress', [('minconf', 'int', 1), ('inclempty', 'bool', False), ('inclwatch', 'bool', False)]),
+    ('listsinceblock', [('blkhash', 'str', None), ('minconf', 'int', 1), ('inclwatch', 'bool', False)]),
+    ('listtransactions', [('acc', 'str', '*'), ('count', 'int', 10), ('skip', 'int', 0), ('inclwatch', 'bool', False)]),
+    ('listunspent', [('minconf', 'int', 1), ('maxconf', 'int', 999999999), ('addrs', 'json', None)]),
+    ('lockunspent', [('unlock', 'bool'), ('txns', 'json')]),
+    ('move', [('fromacc', 'str'), ('toacc', 'str'), ('amnt', 'float'), ('minconf', 'int', 1), ('comment', 'str', '')]),
+    ('sendfrom', [('acc', 'str'), ('addr', 'str'), ('amnt', 'float'), ('minconf', 'int', 1), ('comment', 'str', ''), ('commentto', 'str', '')]),
+    ('sendmany', [('acc', 'str'), ('amnts', 'json'), ('minconf', 'int', 1), ('comment', 'str', ''), ('commenttos', 'json', None)]),
+    ('sendtoaddress', [('addr', 'str'), ('amnt', 'float'), ('comment', 'str', ''), ('commentto', 'str', ''), ('subfeefromamnt', 'bool', False)]),
+    ('setaccount', [('addr', 'str'), ('acc', 'str')]),
+    ('settxfee', [('amnt', 'float')]),
+    ('signmessage', [('addr', 'str'), ('msg', 'str')]),
+    ('help', [('func', 'str', None)])
+]
+
+## Python names that differ from the RPC method.
+FUNC_NAMES = {'help': 'rpchelp'}
+
+## A compiled RPC_SCHEMA entry.
+##
+## params() turns call arguments into the JSON-RPC params list and wrapper
+## is the matching module level function (getblock() etc.). Both are
+## generated as real Python functions so a call does no schema lookups.
+class RPCMethod(object):
+    def __init__(self, method, params):
+        self.method = method
+        self.name = FUNC_NAMES.get(method, method)
+        self.names = [i[0] for i in params]
+        self.required = len([i for i in params if len(i) == 2])
+        self.arity = list(range(self.required, len(params)+1))
+        self.usage = ' '.join(['<%s>' % i[0] if len(i) == 2 else '[%s=%r]' % (i[0], i[2])
+                               for i in params])
+
+        scope = {'rpccommand': rpccommand}
+        args = []
+        body = []
+        for n, param in enumerate(params):
+            scope['_c%d' % n] = COERCIONS[param[1]]
+            if len(param) == 2:
+                args.append(param[0])
+            else:
+                scope['_d%d' % n] = param[2]
+                args.append('%s=_d%d' % (param[0], n))
+                if param[2] is None:
+                    rest = ['%s == _d%d' % (params[m][0], m) for m in range(n+1, len(params))]
+                    body.append('    if %s: return p' % ' and '.join(['%s is None' % param[0]] + rest))
+                    body.append('    p.append(None if %s is None else _c%d(%s))' % (param[0], n, param[0]))
+                    continue
+            body.append('    p.append(_c%d(%s))' % (n, param[0]))
+
+        source = 'def params(%s):\n    p = []\n%s\n    return p\n' % (', '.join(args), '\n'.join(body))
+        exec(source, scope)
+        self.params = scope['params']
+
+        source = 'def %s(%s):\n    return rpccommand(%r, params(%s), display)\n' % (
+            self.name, ', '.join(args + ['display=False']), method, ', '.join(self.names))
+        exec(source, scope)
+        self.wrapper = scope[self.name]
+
+rpc_schema = {}
+for _method, _params in RPC_SCHEMA:
+    rpc_schema[_method] = RPCMethod(_method, _params)
+    globals()[rpc_schema[_method].name] = rpc_schema[_method].wrapper
+
+## Coerce args for method the same way its wrapper would, for batch callers.
+def rpcparams(method, *args, **kwargs):
+    return rpc_schema[method].params(*args, **kwargs)
+
+## Wrappers that do more than forward to rpccommand. They replace the
+## generated ones but keep their schema for arity, usage and coercion.
 def getblockchaininfo(verbose=True, display=False):
     result = rpccommand('getblockchaininfo')
     if display:
@@ -131,284 +485,60 @@ def getblockchaininfo(verbose=True, display=False):
             displayResult(result, ['softforks'])
     return result
 
-def getrawtransaction(txid, verbose=False, display=False):
-    return rpccommand('getrawtransaction', [txid, int(toBool(verbose))], display)
+## Set by sbtclib.headers when the local header cache is enabled.
+_headerstore = None
 
-def signrawtransaction(hexstring, prevtxs=None, privatekeys=None, sighashtype='ALL', display=False):
-    return rpccommand('signrawtransaction', [hexstring, json.loads(prevtxs), json.loads(privatekeys), sighashtype], display)
+def setheaderstore(store):
+    global _headerstore
+    _headerstore = store
 
-def getblockcount(display=False):
-    return rpccommand('getblockcount', [], display)
+## Answer from the local header cache if possible, None otherwise.
+def _localheader(func, *args):
+    store = _headerstore
+    if store is None:
+        return None
+    return getattr(store, func)(*args)
 
-def getbestblockhash(display=False):
-    return rpccommand('getbestblockhash', [], display)
+## Same for answers that depend on the tip, they need a current store.
+def _localtip(func, *args):
+    store = _headerstore
+    if store is None or not store.current():
+        return None
+    return getattr(store, func)(*args)
 
-def getblock(blkhash, verbose=True, display=False):
-    return rpccommand('getblock', [blkhash, toBool(verbose)], display)
+def getbestblockhash(display=False):
+    result = _localtip('getbestblockhash')
+    if result is None:
+        return rpccommand('getbestblockhash', [], display)
+    if display: displayResult(result)
+    return result
 
 def getblockheader(blkhash, verbose=True, display=False):
-    return rpccommand('getblockheader', [blkhash, toBool(verbose)], display)
-
-def getdifficulty(display=False):
-    return rpccommand('getdifficulty', [], display)
-
-def getmempoolinfo(display=False):
-    return rpccommand('getmempoolinfo', [], display)
-
-def getrawmempool(verbose=False, display=False):
-    return rpccommand('getrawmempool', [toBool(verbose)], display)
-
-def gettxout(txid, n, inclmempl=True, display=False):
-    return rpccommand('gettxout', [txid, int(n), toBool(inclmempl)], display)
-
-def ping(display=False):
-    return rpccommand('ping')
-
-def gettxoutproof(txids, blkhash=None, display=False):
-    return rpccommand('gettxoutproof', [json.loads(txids), blkhash]) if blkhash else rpccommand('gettxoutproof', [json.loads(txids)], display)
-
-def getchaintips(display=False):
-    return rpccommand('getchaintips', [], display)
+    params = rpc_schema['getblockheader'].params(blkhash, verbose)
+    # The verbose form has confirmations and nextblockhash.
+    result = (_localtip if params[1] else _localheader)('getblockheader', *params)
+    if result is None:
+        return rpccommand('getblockheader', params, display)
+    if display: displayResult(result)
+    return result
 
 def getblockhash(blkid, display=False):
-    return rpccommand('getblockhash', [int(blkid)], display)
-
-def createrawtransaction(txs, outs, display=False):
-    return rpccommand('createrawtransaction', [json.loads(txs), json.loads(outs)], display)
-
-def gettxoutsetinfo(display=False):
-    return rpccommand('gettxoutsetinfo', [], display)
-
-def verifychain(chklvl=3, numblks=388, display=False):
-    return rpccommand('verifychain', [int(chklvl), int(numblks)], display)
-
-def verifytxoutproof(proof, display=False):
-    return rpccommand('verifytxoutproof', [proof], display)
-
-def stop(display=False):
-    return rpccommand('stop', [], display)
-
-def generate(numblks, display=False):
-    return rpccommand('generate', [int(numblks)], display)
-
-def getgenerate(display=False):
-    return rpccommand('getgenerate', [], display)
-
-def setgenerate(gen, genproclimit=None):
-    if genproclimit:
-        return rpccommand('setgenerate', [toBool(gen), int(genproclimit)], display)
-    else:
-        return rpccommand('setgenerate', [toBool(gen)], display)
-
-def getblocktemplate(jsonReqObj=None, display=False):
-    if jsonReqObj:
-        return rpccommand('getblocktemplate', [json.loads(jsonReqObj)], display)
-    else:
-        return rpccommand('getblocktemplate', [], display)
-
-def getmininginfo(display=False):
-    return rpccommand('getmininginfo', [], display)
-
-def getnetworkhashps(blocks=120, height=-1, display=False):
-    return rpccommand('getnetworkhashps', [int(blocks), int(height)], display)
-
-def prioritisetransaction(txid, priority_d, fee_d, display=False):
-    return rpccommand('prioritisetransaction', [txid, int(priority_d), int(fee_d)], display)
-
-def submitblock(data, jsonParamsObj=None, display=False):
-    if jsonParamsObj:
-        return rpccommand('submitblock', [data, json.loads(jsonParamsObj)], display)
-    else:
-        return rpccommand('submitblock', [data], display)
-    
-def addnode(node, cmd, display=False):
-    return rpccommand('addnode', [node, cmd], display)
-
-def clearbanned(display=False):
-    return rpccommand('clearbanned', [], display)
-
-def disconnectnode(node, display=False):
-    return rpccommand('disconnectnode', [node], display)
-
-def getaddednodeinfo(dns, node=None, display=False):
-    if node:
-        return rpccommand('getaddednodeinfo', [toBool(dns), node], display)
-    else:
-        return rpccommand('getaddednodeinfo', [toBool(dns)], display)
-
-def getconnectioncount(display=False):
-    return rpccommand('getconnectioncount', [], display)
-
-def getnettotals(display=False):
-    return rpccommand('getnettotals', [], display)
-
-def getnetworkinfo(display=False):
-    return rpccommand('getnetworkinfo', [], display)
-
-def listbanned(display=False):
-    return rpccommand('listbanned', [], display)
-
-def setban(ip, cmd, bantime=0, absolute=False, display=False):
-    return rpccommand('setban', [ip, cmd, int(bantime), toBool(absolute)], display)
-
-def decoderawtransaction(hexstr, display=False):
-    return rpccommand('decoderawtransaction', [hexstr], display)
-
-def decodescript(hexraw, display=False):
-    return rpccommand('decodescript', [hexraw], display)
-
-def fundrawtransaction(hexstr, inclwatch, display=False):
-    return rpccommand('fundrawtransaction', [hexstr, toBool(inclwatch)], display)
-
-def sendrawtransaction(hexstr, allowhighfees=False, display=False):
-    return rpccommand('sendrawtransaction', [hexstr, toBool(allowhighfees)], display)
-
-def createmultisig(nreq, keys, display=False):
-    return rpccommand('createmultisig', [int(nreq), json.loads(keys)], display)
-
-def estimatefee(nblks, display=False):
-    return rpccommand('estimatefee', [int(nblks)], display)
-
-def estimatepriority(nblks, display=False):
-    return rpccommand('estimatepriority', [int(nblks)], display)
-
-def estimatesmartfee(nblks, display=False):
-    return rpccommand('estimatesmartfee', [int(nblks)], display)
-
-def estimatesmartpriority(nblks, display=False):
-    return rpccommand('estimatesmartpriority', [int(nblks)], display)
-
-def validateaddress(addr, display=False):
-    return rpccommand('validateaddress', [addr], display)
-
-def abandontransaction(txid, display=False):
-    return rpccommand('abandontransaction', [txid], display)
-
-def addmultisigaddress(nreq, keys, account='', display=False):
-    return rpccommand('abdmultisigaddress', [int(nreq), json.loads(keys), account], display)
-
-def backupwallet(dest, display=False):
-    return rpccommand('backupwallet', [dest], display)
-
-def encryptwallet(passphr, display=False):
-    return rpccommand('encryptwallet', [passphr], display)
-
-def dumpprivkey(addr, display=False):
-    return rpccommand('dumpprivkey', [addr], display)
-
-def dumpwallet(filen, display=False):
-    return rpccommand('dumpwallet', [filen], display)
-
-def getaccount(addr, display=False):
-    return rpccommand('getaccount', [addr], display)
-
-def getaccountaddress(acc, display=False):
-    return rpccommand('getaccountaddress', [acc], display)
-
-def getaddressesbyaccount(acc, display=False):
-    return rpccommand('getaddressesbyaccount', [acc], display)
-
-def getbalance(acc='*', minconf=1, inclwatch=False, display=False):
-    return rpccommand('getbalance', [acc, int(minconf), toBool(inclwatch)], display)
-
-def getnewaddress(acc='', display=False):
-    return rpccommand('getnewaddress', [acc], display)
-
-def getrawchangeaddress(display=False):
-    return rpccommand('getrawchangeaddress', [], display)
-
-def getreceivedbyaccount(acc, minconf=1, display=False):
-    return rpccommand('getreceivedbyaccount', [acc, int(minconf)], display)
-
-def getreceivedbyaddress(addr, minconf=1, display=False):
-    return rpccommand('getreceivedbyaddress', [addr, int(minconf)], display)
-
-def gettransaction(txid, inclwatch=False, display=False):
-    return rpccommand('gettransaction', [txid, toBool(inclwatch)], display)
-
-def getunconfirmedbalance(display=False):
-    return rpccommand('getunconfirmedbalance', [], display)
-
-def getwalletinfo(display=False):
-    return rpccommand('getwalletinfo', [], display)
-
-def importaddress(addr, label='', rescan=True, p2sh=False, display=False):
-    return rpccommand('importaddress', [addr, label, toBool(rescan), toBool(p2sh)], display)
-
-def importprivkey(privkey, label='', rescan=True, display=False):
-    return rpccommand('importprivkey', [privkey, label, toBool(rescan)], display)
-
-def importpubkey(pubkey, label='', rescan=True, display=False):
-    return rpccommand('importpubkey', [pubkey, label, toBool(rescan)], display)
-
-def importwallet(filen, display=False):
-    return rpccommand('importwallet', [filen], display)
-
-def keypoolrefill(size=100, display=False):
-    return rpccommand('keypoolrefill', [int(size)], display)
-
-def listaccounts(minconf=1, inclwatch=False, display=False):
-    return rpccommand('listaccounts', [int(minconf), toBool(inclwatch)], display)
-
-def listaddressgroupings(display=False):
-    return rpccommand('listaddressgroupings', [], display)
-
-def listlockunspent(display=False):
-    return rpccommand('listlockunspent', [], display)
-
-def listreceivedbyaccount(minconf=1, inclempty=False, inclwatch=False, display=False):
-    return rpccommand('listreceivedbyaccount', [int(minconf), toBool(inclempty), toBool(inclwatch)], display)
-
-def listreceivedbyaddress(minconf=1, inclempty=False, inclwatch=False, display=False):
-    return rpccommand('listreceivedbyaddress', [int(minconf), toBool(inclempty), toBool(inclwatch)], display)
-
-def listsinceblock(blkhash=None, minconf=1, inclwatch=False, display=False):
-    if blkhash:
-        return rpccommand('listsinceblock', [blkhash, int(minconf), toBool(inclwatch)], display)
-    else:
-        return rpccommand('listsinceblock', [], display)
-
-def listtransactions(acc='*', count=10, skip=0, inclwatch=False, display=False):
-    return rpccommand('listtransactions', [acc, int(count), int(skip), toBool(inclwatch)], display)
-
-def listunspent(minconf=1, maxconf=999999999, addrs=None, display=False):
-    if addrs:
-        return rpccommand('listunspent', [int(minconf), int(maxconf), json.loads(addrs)], display)
-    else:
-        return rpccommand('listunspent', [int(minconf), int(maxconf)], display)
-
-def lockunspent(unlock, txns, display=False):
-    return rpccommand('lockunspent', [toBool(unlock), json.loads(txns)], display)
-
-def move(fromacc, toacc, amnt, minconf=1, comment='', display=False):
-    return rpccommand('move', [fromacc, toacc, float(amnt), int(minconf), comment], display)
-
-def sendfrom(acc, addr, amnt, minconf=1, comment='', commentto='', display=False):
-    return rpccommand('sendfrom', [acc, addr, float(amnt), int(minconf), comment, commentto], display)
-
-def sendmany(acc, amnts, minconf=1, comment='', commenttos=None, display=False):
-    if commenttos:
-        return rpccommand('sendmany', [acc, json.loads(amnts), int(minconf), comment, json.loads(commenttos)], display)
-    else:
-        return rpccommand('sendmany', [acc, json.loads(amnts), int(minconf), comment], display)
-
-def sendtoaddress(addr, amnt, comment='', commentto='', subfeefromamnt=False, display=False):
-    return rpccommand('sendtoaddress', [addr, float(amnt), comment, commentto, toBool(subfeefromamnt)], display)
-
-def setaccount(addr, acc, display=False):
-    return rpccommand('setaccount', [addr, acc], display)
-
-def settxfee(amnt, display=False):
-    return rpccommand('settxfee', [float(amnt)], display)
-
-def signmessage(addr, msg, display=False):
-    return rpccommand('signmessage', [addr, msg], display)
+    params = rpc_schema['getblockhash'].params(blkid)
+    result = _localheader('getblockhash', *params)
+    if result is None:
+        return rpccommand('getblockhash', params, display)
+    if display: displayResult(result)
+    return result
 
-def verifymessage(addr, sig, msg, display=False):
-    return rpccommand('verifymessage', [addr, sig, msg], display)
+## Console usage of a wrapped RPC, as generated from its schema.
+def rpcusage(method):
+    entry = rpc_commands[method]
+    return '%s %s' % (method, entry[2]) if len(entry) > 2 else method
 
 def rpchelp(func=None, display=False):
     if func:
+        if display and func in rpc_commands:
+            print('Usage: ' + rpcusage(func))
         result = rpccommand('help', [func], display)
     else:
         result = rpccommand('help')
@@ -416,111 +546,28 @@ def rpchelp(func=None, display=False):
 
     return result
 
+## bitcoind's command list, with the console usage for supported commands.
 # TODO Find a clean way to integrate extended help
 def getRPCHelp(display=True):
     result = rpccommand('help')
     for i in result.split('\n'):
         if len(i) > 0 and i[0] != '=':
             if i.split()[0] in rpc_commands:
-                print(i)
+                print(rpcusage(i.split()[0]))
             else:
                 print('*' + i)
         else:
             print(i)
     print('* = Unsupported')
 
-rpc_commands = {
-    'getinfo':[[0], getinfo],
-    'getblockchaininfo':[[0, 1], lambda x=False, display=False:getblockchaininfo(toBool(x), display),
-                 '[verbose=False]'],
-    'getblockcount':[[0], getblockcount],
-    'getbestblockhash':[[0], getbestblockhash],
-    'getblock':[[1, 2], getblock],
-    'getblockheader':[[1, 2], getblockheader],
-    'getdifficulty':[[0], getdifficulty],
-    'getmempoolinfo':[[0], getmempoolinfo],
-    'getrawmempool':[[0, 1], getrawmempool],
-    'gettxout':[[2, 3], gettxout],
-    'ping':[[0], ping],
-    'gettxoutproof':[[1, 2], gettxoutproof],
-    'getchaintips':[[0], getchaintips],
-    'getblockhash':[[1], getblockhash],
-    'getpeerinfo':[[0], getpeerinfo],
-    'getrawtransaction':[[1, 2], getrawtransaction],
-    'createrawtransaction':[[2], createrawtransaction],
-    'gettxoutsetinfo':[[0], gettxoutsetinfo],
-    'verifychain':[[0, 1, 2], verifychain],
-    'verifytxoutproof':[[1], verifytxoutproof],
-    'stop':[[0], stop],
-    'generate':[[1], generate],
-    'getgenerate':[[0], getgenerate],
-    'setgenerate':[[1, 2], setgenerate],
-    'getblocktemplate':[[0, 1], getblocktemplate],
-    'getmininginfo':[[0], getmininginfo],
-    'getnetworkhashps':[[0, 1, 2], getnetworkhashps],
-    'prioritisetransaction':[[3], prioritisetransaction],
-    'submitblock':[[1, 2], submitblock],
-    'addnode':[[2], addnode],
-    'clearbanned':[[0], clearbanned],
-    'disconnectnode':[[1], disconnectnode],
-    'getaddednodeinfo':[[1, 2], getaddednodeinfo],
-    'getconnectioncount':[[0], getconnectioncount],
-    'getnettotals':[[0], getnettotals],
-    'getnetworkinfo':[[0], getnetworkinfo],
-    'listbanned':[[0], listbanned],
-    'setban':[[2, 3, 4], setban],
-    'signrawtransaction':[[1, 2, 3, 4], signrawtransaction],
-    'decoderawtransaction':[[1], decoderawtransaction],
-    'decodescript':[[1], decodescript],
-    'fundrawtransaction':[[2], fundrawtransaction],
-    'sendrawtransaction':[[1, 2], sendrawtransaction],
-    'createmultisig':[[2], createmultisig],
-    'estimatefee':[[1], estimatefee],
-    'estimatepriority':[[1], estimatepriority],
-    'estimatesmartfee':[[1], estimatesmartfee],
-    'estimatesmartpriority':[[1], estimatesmartpriority],
-    'validateaddress':[[1], validateaddress],
-    'verifymessage':[[3], verifymessage],
-    'abandontransaction':[[1], abandontransaction],
-    'addmultisigaddress':[[2, 3], addmultisigaddress],
-    'backupwallet':[[1], backupwallet],
-    'dumpprivkey':[[1], dumpprivkey],
-    'dumpwallet':[[1], dumpwallet],
-    'encryptwallet':[[1], encryptwallet],
-    'getaccount':[[1], getaccount],
-    'getaccountaddress':[[1], getaccountaddress],
-    'getaddressesbyaccount':[[1], getaddressesbyaccount],
-    'getbalance':[[0, 1, 2, 3], getbalance],
-    'getnewaddress':[[0, 1], getnewaddress],
-    'getrawchangeaddress':[[0], getrawchangeaddress],
-    'getreceivedbyaccount':[[1, 2], getreceivedbyaccount],
-    'getreceivedbyaddress':[[1, 2], getreceivedbyaddress],
-    'gettransaction':[[1, 2], gettransaction],
-    'getunconfirmedbalance':[[0], getunconfirmedbalance],
-    'getwalletinfo':[[0], getwalletinfo],
-    'importaddress':[[1, 2, 3, 4], importaddress],
-    'importprivkey':[[1, 2, 3], importprivkey],
-    'importpubkey':[[1, 2, 3], importpubkey],
-    'importwallet':[[1], importwallet],
-    'keypoolrefill':[[0, 1], keypoolrefill],
-    'listaccounts':[[0, 1, 2], listaccounts],
-    'listaddressgroupings':[[0], listaddressgroupings],
-    'listlockunspent':[[0], listlockunspent],
-    'listreceivedbyaccount':[[0, 1, 2, 3], listreceivedbyaccount],
-    'listreceivedbyaddress':[[0, 1, 2, 3], listreceivedbyaddress],
-    'listsinceblock':[[0, 1, 2, 3], listsinceblock],
-    'listtransactions':[[0, 1, 2, 3, 4], listtransactions],
-    'listunspent':[[0, 1, 2, 3], listunspent],
-    'lockunspent':[[2], lockunspent],
-    'move':[[3, 4, 5], move],
-    'sendfrom':[[3, 4, 5, 6], sendfrom],
-    'sendmany':[[2, 3, 4, 5], sendmany],
-    'sendtoaddress':[[2, 3, 4, 5], sendtoaddress],
-    'setaccount':[[2], setaccount],
-    'settxfee':[[1], settxfee],
-    'signmessage':[[2], signmessage],
-    'help':[[0, 1], rpchelp]
-}
+rpc_commands = {}
+for _method, _params in RPC_SCHEMA:
+    _entry = rpc_schema[_method]
+    rpc_commands[_method] = [_entry.arity, globals()[_entry.name]]
+    if _entry.usage:
+        rpc_commands[_method].append(_entry.usage)
+rpc_commands['getblockchaininfo'] = [[0, 1], lambda x=False, display=False:getblockchaininfo(toBool(x), display),
+                                     '[verbose=False]']
 
 ## ["command", [no. of args (-1, no limit)], function, optional helptext]
 # FIXME Deprecate "commands"
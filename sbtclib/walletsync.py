@@ -0,0 +1,208 @@
+#
+# Copyright (c) 2016, gijensen
+#
+from __future__ import print_function
+import os, json, bisect, threading
+from . import config
+from .srpc import rpccommand, displayResult
+
+WALLET_STATE_VERSION = 1
+## Coinbase outputs become spendable at this depth.
+COINBASE_MATURITY = 101
+COINBASE_CATEGORIES = ('generate', 'immature', 'orphan')
+
+## Key identifying a wallet entry, a tx has one entry per output and category.
+## Coinbase entries change category as they mature so it isn't part of theirs.
+def _key(tx):
+    category = tx['category']
+    if category in COINBASE_CATEGORIES:
+        category = 'coinbase'
+    return '%s:%s:%s:%s' % (tx['txid'], tx.get('vout', ''), category, tx.get('address', ''))
+
+## Local copy of the wallet's transactions kept current with listsinceblock.
+##
+## Each run only asks bitcoind for what happened since the last synced block.
+## Confirmed entries get an increasing seq number which doubles as the
+## cursor for iterating over them. Unconfirmed entries are replaced on every
+## sync. If the last synced block was reorged out, entries above the fork
+## point are dropped and the sync resumes from there.
+class WalletSync(object):
+    def __init__(self, datadir=None, inclwatch=False):
+        if datadir is None:
+            datadir = config.DATADIR
+        self.path = datadir + '/sbtc.wallet'
+        self.inclwatch = inclwatch
+        self.lock = threading.RLock()
+        self.lastblock = None
+        self.height = -1
+        self.nextseq = 0
+        self.txs = []
+        self.seqs = []
+        self.keys = {}
+        self.pending = []
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                state = json.load(f)
+        except (IOError, OSError, ValueError):
+            return False
+        if state.get('version') != WALLET_STATE_VERSION:
+            return False
+        with self.lock:
+            self.lastblock = state['lastblock']
+            self.height = state['height']
+            self.nextseq = state['nextseq']
+            self.pending = state['pending']
+            self._settxs(state['txs'])
+        return True
+
+    def save(self):
+        with self.lock:
+            state = {
+                'version': WALLET_STATE_VERSION,
+                'lastblock': self.lastblock,
+                'height': self.height,
+                'nextseq': self.nextseq,
+                'txs': self.txs,
+                'pending': self.pending
+            }
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(state, f)
+            os.rename(tmp, self.path)
+
+    ## Must be called with self.lock held.
+    def _settxs(self, txs):
+        self.txs = txs
+        self.seqs = [i['seq'] for i in txs]
+        self.keys = dict((_key(i), n) for n, i in enumerate(txs))
+
+    ## Find the newest ancestor of lastblock still in the main chain.
+    def _forkpoint(self):
+        blkhash = self.lastblock
+        while blkhash is not None:
+            header = rpccommand('getblockheader', [blkhash, True])
+            if header['confirmations'] >= 0:
+                return blkhash, header['height']
+            blkhash = header.get('previousblockhash')
+        return None, -1
+
+    def _rollback(self):
+        blkhash, height = self._forkpoint()
+        with self.lock:
+            self._settxs([i for i in self.txs if i['height'] <= height])
+            self.lastblock = blkhash
+            self.height = height
+        return height
+
+    def sync(self, display=False):
+        dropped = 0
+        if self.lastblock is not None:
+            header = rpccommand('getblockheader', [self.lastblock, True])
+            if header['confirmations'] < 0:
+                count = len(self.txs)
+                self._rollback()
+                dropped = count - len(self.txs)
+
+        if self.lastblock is None:
+            result = rpccommand('listsinceblock', ['', 1, self.inclwatch])
+        else:
+            result = rpccommand('listsinceblock', [self.lastblock, 1, self.inclwatch])
+        tip = rpccommand('getblockheader', [result['lastblock'], True])['height']
+
+        added = 0
+        pending = []
+        with self.lock:
+            txs = list(self.txs)
+            for tx in result['transactions']:
+                if tx.get('category') == 'move':
+                    continue
+                if tx.get('confirmations', 0) <= 0 or 'blockhash' not in tx:
+                    pending.append(tx)
+                    continue
+                tx['height'] = tx.get('blockheight', tip - tx['confirmations'] + 1)
+                key = _key(tx)
+                if key in self.keys:
+                    tx['seq'] = txs[self.keys[key]]['seq']
+                    txs[self.keys[key]] = tx
+                else:
+                    tx['seq'] = self.nextseq
+                    self.nextseq += 1
+                    self.keys[key] = len(txs)
+                    txs.append(tx)
+                    added += 1
+            self._settxs(txs)
+            self.pending = pending
+            self.lastblock = result['lastblock']
+            self.height = tip
+        self.save()
+
+        if display:
+            print('Wallet synced to height %d: %d new, %d pending, %d dropped by reorg.' % (tip, added, len(pending), dropped))
+        return added
+
+    ## Returns up to count confirmed entries with seq >= cursor and the cursor
+    ## to continue from.
+    def page(self, cursor=0, count=None):
+        with self.lock:
+            start = bisect.bisect_left(self.seqs, cursor)
+            end = len(self.txs) if count is None else start + count
+            txs = self.txs[start:end]
+        return txs, txs[-1]['seq'] + 1 if txs else cursor
+
+    def iterate(self, cursor=0, count=100):
+        while True:
+            txs, cursor = self.page(cursor, count)
+            if not txs:
+                return
+            for tx in txs:
+                yield tx
+
+    ## Same rules as getbalance: minconf=0 includes unconfirmed entries and
+    ## coinbase outputs only count once mature. Fees are counted once per tx.
+    def balance(self, minconf=1, address=None):
+        total = 0
+        feepaid = set()
+        with self.lock:
+            txs = self.txs + (self.pending if minconf <= 0 else [])
+            for tx in txs:
+                if address is not None and tx.get('address') != address:
+                    continue
+                depth = self.height - tx['height'] + 1 if 'height' in tx else 0
+                if depth < minconf:
+                    continue
+                if tx['category'] in COINBASE_CATEGORIES:
+                    if tx['category'] == 'orphan' or depth < COINBASE_MATURITY:
+                        continue
+                elif tx['category'] not in ('send', 'receive'):
+                    continue
+                total += int(round(tx['amount'] * 1e8))
+                if 'fee' in tx and tx['txid'] not in feepaid:
+                    feepaid.add(tx['txid'])
+                    total += int(round(tx['fee'] * 1e8))
+        return total / 1e8
+
+_wallet = None
+
+def getwalletsync():
+    global _wallet
+    if _wallet is None:
+        _wallet = WalletSync()
+    return _wallet
+
+def syncwallet(display=False):
+    return getwalletsync().sync(display)
+
+def walletbalance(minconf=1, display=False):
+    result = getwalletsync().balance(int(minconf))
+    if display: print('%0.8f' % result)
+    return result
+
+def wallettxs(cursor=0, count=10, display=False):
+    txs, cursor = getwalletsync().page(int(cursor), int(count))
+    if display:
+        displayResult(txs)
+        print('Next cursor: %d' % cursor)
+    return txs, cursor